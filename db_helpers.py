@@ -1,6 +1,6 @@
 #! /usr/bin/python3
 # -*- coding:utf-8 -*-
-from flask import Flask, request, g
+from flask import Flask, request, g, flash
 from datetime import *
 from ossaca_database import *
 
@@ -8,23 +8,43 @@ app = Flask(__name__)
 
 # ----------- GENERAL ----------- #
 
+# Shared by all the requests handled by this process, each thread of the
+# server leasing its own storage for the time of a request
+storage_manager = SQLiteStorageManager("ossaca_db.sqlite", max_storages = 8)
+
 def getdb():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = SQLiteStorage()
-        db.connect("ossaca_db.sqlite")
+        db = g._database = storage_manager.acquire()
     return db
 
 @app.teardown_appcontext
 def closedb(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        storage_manager.release(db, exception)
+
+# The implants are unique : a form may reuse the implant of another animal
+def write_animal(write, animal):
+    '''
+    Writes animal with write, db.add or db.update. Returns False, with a
+    message flashed to the user, if its implant is already used.
+    '''
+    try:
+        write(animal)
+    except sqlite3.IntegrityError as e:
+        if "animal.implant" not in str(e):
+            raise
+
+        flash("Le numéro d'implant %s est déjà utilisé par un autre animal" % animal.implant)
+        return False
+
+    return True
 
 # ----------- DOG ----------- #
 
 def get_dogs():
-    dogs = getdb().get_all_dogs()
+    dogs = getdb().get_dog_summaries()
     return dogs
 
 def add_new_dog(form):
@@ -41,7 +61,8 @@ def add_new_dog(form):
     dog.ok_cats = form['ok_cats'] if 'ok_cats' in form else 0
     dog.character = form['char']
     dog.history = form['history']
-    db.add(dog)
+    if not write_animal(db.add, dog):
+        return None
     return dog.id
 
 def update_pictures_dog(id, pictures):
@@ -65,12 +86,12 @@ def update_dog(form):
     dog.category = form['category']
     dog.character = form['char']
     dog.history = form['history']
-    db.update(dog)
+    write_animal(db.update, dog)
 
 # ----------- CAT ----------- #
 
 def get_cats():
-    cats = getdb().get_all_cats()
+    cats = getdb().get_cat_summaries()
     return cats
 
 def add_new_cat(form):
@@ -87,7 +108,7 @@ def add_new_cat(form):
     cat.has_fiv = form['fiv'] if 'fiv' in form else 0
     cat.has_felv = form['felv'] if 'felv' in form else 0
     cat.history = form['history']
-    db.add(cat)
+    write_animal(db.add, cat)
 
 def update_pictures_cat(id, pictures):
     db = getdb()
@@ -110,7 +131,17 @@ def update_cat(form):
     cat.has_felv = form['felv'] if 'felv' in form else 0
     cat.character = form['char']
     cat.history = form['history']
-    db.update(cat)
+    write_animal(db.update, cat)
+
+# ----------- SEARCH ----------- #
+
+def search_animals(query, species = None):
+    animals = getdb().search_animals(query, species)
+    return animals
+
+def get_animal_by_implant(implant):
+    animal = getdb().get_animal_by_implant(implant)
+    return animal
 
 # ----------- CARE ----------- #
 
@@ -197,6 +228,10 @@ def get_boxes():
     boxes = getdb().get_all_boxes()
     return boxes
 
+def get_box_occupancy():
+    occupancy = getdb().get_box_occupancy()
+    return occupancy
+
 def add_new_box(form):
     db = getdb()
     box = Box()
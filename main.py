@@ -1,7 +1,9 @@
 #! /usr/bin/python3
 # -*- coding:utf-8 -*-
-from flask import Flask, flash, render_template, request, g
+from flask import Flask, flash, render_template, request, g, redirect, abort
+from flask import Response, stream_with_context
 from db_helpers import *
+import ossaca_export
 from upload import *
 
 # ----------- GENERAL ----------- #
@@ -10,6 +12,9 @@ app = Flask(__name__)
 
 app.secret_key = 'prouttrucmuche'
 
+# Give the storage back to the pool at the end of each request
+app.teardown_appcontext(closedb)
+
 @app.route('/')
 
 @app.route('/home')
@@ -25,8 +30,9 @@ def dogs():
             update_dog(request.form)
         else:
             id = add_new_dog(request.form)
-            pictures = upload_image(id, request)
-            update_pictures_dog(id, pictures)
+            if id is not None:
+                pictures = upload_image(id, request)
+                update_pictures_dog(id, pictures)
 
     dlist = get_dogs()
     return render_template('dogs.html', dogs = dlist)
@@ -72,6 +78,49 @@ def cat(id, species='cat', name=None):
     cat = getdb().get_cat_by_id(id)
     return render_template('animal.html', species=species, animal=cat)
 
+# ----------- SEARCH ----------- #
+
+@app.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '')
+    species = request.args.get('species', None, type=int)
+    animals = search_animals(query, species)
+    return render_template('search.html', query=query, animals=animals)
+
+# Quick lookup for microchip scanners : /implant/<number> or /implant?number=
+@app.route('/implant', methods=['GET'])
+@app.route('/implant/<implant>', methods=['GET'])
+def implant(implant=None):
+    if implant is None:
+        implant = request.args.get('number', '')
+
+    animal = get_animal_by_implant(implant)
+
+    if animal is None:
+        abort(404)
+
+    if isinstance(animal, Dog):
+        return redirect('/dog/%d' % animal.id)
+    if isinstance(animal, Cat):
+        return redirect('/cat/%d' % animal.id)
+
+    return render_template('search.html', query=implant, animals=[animal])
+
+# ----------- EXPORT ----------- #
+
+# Streams a register (animals, sheets, caresheets or locations) as csv or jsonl
+@app.route('/export/<register>.<format>', methods=['GET'])
+def export(register, format):
+    if register not in ossaca_export.registers or format not in ossaca_export.formats:
+        abort(404)
+
+    lines = ossaca_export.iter_export(getdb(), register, format)
+    filename = "%s.%s" % (register, format)
+
+    return Response(stream_with_context(lines),
+                    mimetype=ossaca_export.formats[format],
+                    headers={"Content-Disposition": "attachment; filename=" + filename})
+
 # ----------- CARES ----------- #
 
 @app.route('/cares', methods=['GET', 'POST'])
@@ -135,8 +184,8 @@ def box():
                 update_box(request.form)
         else:
             add_new_box(request.form);
-    boxes = get_boxes()
-    return render_template('admin-boxes.html', boxes=boxes)
+    occupancy = get_box_occupancy()
+    return render_template('admin-boxes.html', occupancy=occupancy)
 
 # ----------- STATES ----------- #
 
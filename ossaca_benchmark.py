@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''
+Measures the memory used by each model object, with the slotted classes of
+ossaca_model against the same classes with a per-instance __dict__.
+
+Usage : ossaca_benchmark.py [number of objects]
+'''
+
+import sys, tracemalloc
+from ossaca_model import *
+
+def unslotted(cls):
+    '''
+    Returns a class built with the same __init__ as cls, but whose instances
+    store their attributes in a __dict__ as before
+    '''
+    return type("Dict" + cls.__name__, (), {"__init__" : cls.__init__})
+
+def measure(factory, n):
+    '''
+    Returns the number of bytes allocated per object when building n objects
+    with factory
+    '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory() for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / n
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    classes = [State, Animal, Dog, Cat, Care, CareSheet, FoodHabit, Location,
+               Sheet, Box, Person]
+
+    print("%-10s %10s %10s %8s" % ("class", "__dict__", "__slots__", "saved"))
+
+    for cls in classes:
+        dict_cls = unslotted(cls)
+        dict_size = measure(dict_cls, n)
+        slots_size = measure(cls, n)
+
+        print("%-10s %9dB %9dB %7d%%" % (cls.__name__, dict_size, slots_size,
+                                         100 * (1 - slots_size / dict_size)))
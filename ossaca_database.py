@@ -1,12 +1,177 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-import sys, inspect, glob, sqlite3, os
+import sys, inspect, glob, logging, sqlite3, os, re, threading
 import os.path
+from collections import ChainMap, namedtuple
+from contextlib import contextmanager
 from enum import IntEnum
 from ossaca_model import *
 from ossaca_plugin import *
 
+class LazyProxy:
+    '''
+    Stands for an object that is loaded from the database only on first
+    access to one of its attributes. The id is known without loading anything.
+
+    Once loaded, the object is cached and all attribute reads and writes go to
+    it. Comparing a proxy with None or with another object compares the loaded
+    object, so a proxy to a missing row is equal to None.
+
+    :param id: Id of the object
+    :type id: int
+
+    :param loader: Function taking no argument and returning the object
+    :type loader: function
+    '''
+    def __init__(self, id, loader):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "_LazyProxy__loader", loader)
+        object.__setattr__(self, "_LazyProxy__loaded", False)
+        object.__setattr__(self, "_LazyProxy__obj", None)
+
+    def resolve(self):
+        '''
+        Returns the object behind the proxy, loading it if needed
+        '''
+        if not self.__loaded:
+            object.__setattr__(self, "_LazyProxy__obj", self.__loader())
+            object.__setattr__(self, "_LazyProxy__loaded", True)
+            object.__setattr__(self, "_LazyProxy__loader", None)
+
+        return self.__obj
+
+    @classmethod
+    def unwrap(cls, obj):
+        '''
+        Returns the object behind obj if it is a proxy, obj itself otherwise
+        '''
+        if type(obj) is LazyProxy:
+            return obj.resolve()
+
+        return obj
+
+    @property
+    def __class__(self):
+        # So that isinstance() sees the class of the loaded object
+        return type(self.resolve())
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+        if name == "id":
+            object.__setattr__(self, "id", value)
+
+    def __eq__(self, other):
+        return self.resolve() == LazyProxy.unwrap(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.resolve())
+
+    def __bool__(self):
+        return self.resolve() is not None
+
+class _LazyBatch:
+    '''
+    Gathers the proxies created while loading a list of objects, so that the
+    first access to any of them loads all the pending ones of the same class
+    in a single go instead of one query per proxy.
+
+    :param load: Function taking a class and a list of ids, and returning a
+    dict of the loaded objects indexed by id
+    :type load: function
+    '''
+    def __init__(self, load):
+        self.__load = load
+        self.__pending = {}
+        self.__loaded = {}
+
+    def reference(self, cls, id, on_load = None):
+        self.__pending.setdefault(cls, set()).add(id)
+
+        def loader():
+            key = (cls, id)
+
+            if key not in self.__loaded:
+                ids = self.__pending.pop(cls, set())
+                ids.add(id)
+                objects = self.__load(cls, list(ids))
+
+                for loaded_id in ids:
+                    self.__loaded[(cls, loaded_id)] = objects.get(loaded_id)
+
+            obj = self.__loaded.get(key)
+
+            if obj is not None and on_load is not None:
+                on_load(obj)
+
+            return obj
+
+        return LazyProxy(id, loader)
+
+# Columns of the animal list pages : state is the label of the state of the
+# latest sheet, location_type and box describe its location, and picture is
+# the first picture of the animal
+summary_fields = ["id", "name", "picture", "gender", "birth_date",
+                  "arrival_date", "neutered", "state", "location_type", "box"]
+
+class DogSummary(namedtuple("DogSummary", summary_fields + ["ok_cats"])):
+    '''
+    Read-only record holding what the dog list pages show of a dog
+    '''
+    __slots__ = ()
+    age = Animal.age
+
+class CatSummary(namedtuple("CatSummary",
+                            summary_fields + ["has_fiv", "has_felv"])):
+    '''
+    Read-only record holding what the cat list pages show of a cat
+    '''
+    __slots__ = ()
+    age = Animal.age
+
+class BoxOccupancy(namedtuple("BoxOccupancy", ["box", "occupants"])):
+    '''
+    Number of animals currently in a box, by species
+
+    :param box: The box
+    :type box: Box
+
+    :param occupants: Number of animals whose latest sheet locates them in the
+    box, indexed by Species. Species without any animal are missing.
+    :type occupants: dict
+    '''
+    __slots__ = ()
+
+    def count(self, species = None):
+        '''
+        Returns the number of animals of the given species in the box, or of
+        all the animals if species is None
+        '''
+        if species is None:
+            return sum(self.occupants.values())
+
+        return self.occupants.get(species, 0)
+
+    def capacity(self, species = Species.DOG):
+        '''
+        Returns Box.capacity(species), or -1 if the surface of the box is
+        unknown
+        '''
+        if not isinstance(self.box.surface_area, (int, float)):
+            return -1
+
+        return self.box.capacity(species)
+
+def _migrate_implant_index(storage):
+    storage.enforce_unique_implants()
+
 class SQLiteStorage:
     '''
     Class used to store and load all entities described in the model using
@@ -27,12 +192,187 @@ class SQLiteStorage:
         Box : "box"
     }
 
-    def __init__(self):
+    # Schema migrations, applied in order by connect(). The schema version
+    # of a database, stored in its user_version pragma, is the number of
+    # migrations already applied to it. A migration is a list of statements,
+    # or of functions called with the storage for the steps depending on the
+    # data.
+    migrations = [
+        # 1 : Indexes for the lookups done by foreign key
+        [
+            "CREATE INDEX IF NOT EXISTS sheet_animal_id ON sheet(animal_id)",
+            "CREATE INDEX IF NOT EXISTS caresheet_animal_id ON caresheet(animal_id)",
+            "CREATE INDEX IF NOT EXISTS dog_animal_id ON dog(animal_id)",
+            "CREATE INDEX IF NOT EXISTS cat_animal_id ON cat(animal_id)",
+            "CREATE INDEX IF NOT EXISTS location_box_id ON location(box_id)",
+            "CREATE INDEX IF NOT EXISTS animal_latest_sheet_id ON animal(latest_sheet_id)",
+            "CREATE INDEX IF NOT EXISTS animal_species_id ON animal(species_id)",
+        ],
+        # 2 : Full-text index of the animals, kept in sync by triggers
+        [
+            '''CREATE VIRTUAL TABLE IF NOT EXISTS animal_fts USING fts5(
+                   name, breed, color, character, history,
+                   content = 'animal', content_rowid = 'id',
+                   tokenize = 'unicode61 remove_diacritics 1',
+                   prefix = '2 3'
+                   )''',
+            # Matches on the name first, then on the breed and color
+            "INSERT INTO animal_fts(animal_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 5.0, 1.0, 1.0)')",
+            '''CREATE TRIGGER IF NOT EXISTS animal_fts_insert AFTER INSERT ON animal BEGIN
+                   INSERT INTO animal_fts(rowid, name, breed, color, character, history)
+                   VALUES (new.id, new.name, new.breed, new.color, new.character, new.history);
+               END''',
+            '''CREATE TRIGGER IF NOT EXISTS animal_fts_delete AFTER DELETE ON animal BEGIN
+                   INSERT INTO animal_fts(animal_fts, rowid, name, breed, color, character, history)
+                   VALUES ('delete', old.id, old.name, old.breed, old.color, old.character, old.history);
+               END''',
+            '''CREATE TRIGGER IF NOT EXISTS animal_fts_update
+               AFTER UPDATE OF name, breed, color, character, history ON animal BEGIN
+                   INSERT INTO animal_fts(animal_fts, rowid, name, breed, color, character, history)
+                   VALUES ('delete', old.id, old.name, old.breed, old.color, old.character, old.history);
+                   INSERT INTO animal_fts(rowid, name, breed, color, character, history)
+                   VALUES (new.id, new.name, new.breed, new.color, new.character, new.history);
+               END''',
+            "INSERT INTO animal_fts(animal_fts) VALUES ('rebuild')",
+        ],
+        # 3 : Microchip numbers are unique, animals without one are left out.
+        # Databases already holding duplicates get a plain index instead.
+        [
+            _migrate_implant_index,
+        ],
+        # 4 : Missing dates are NULL instead of '', and dates are indexed
+        [
+            "UPDATE animal SET birth_date = NULL WHERE birth_date = ''",
+            "UPDATE animal SET arrival_date = NULL WHERE arrival_date = ''",
+            "UPDATE sheet SET date = NULL WHERE date = ''",
+            "UPDATE caresheet SET date = NULL WHERE date = ''",
+            "UPDATE caresheet SET time = NULL WHERE time = ''",
+            "CREATE INDEX IF NOT EXISTS animal_arrival_date ON animal(arrival_date)",
+            "CREATE INDEX IF NOT EXISTS sheet_date ON sheet(date)",
+            "CREATE INDEX IF NOT EXISTS caresheet_date ON caresheet(date, time)",
+        ],
+        # 5 : Counter of the changes to the configuration, so that cached
+        # configurations can be checked with a single row
+        [
+            "CREATE TABLE IF NOT EXISTS config_version (version integer NOT NULL)",
+            "INSERT INTO config_version SELECT 0 WHERE NOT EXISTS (SELECT * FROM config_version)",
+            '''CREATE TRIGGER IF NOT EXISTS config_insert AFTER INSERT ON config BEGIN
+                UPDATE config_version SET version = version + 1;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS config_update AFTER UPDATE ON config BEGIN
+                UPDATE config_version SET version = version + 1;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS config_delete AFTER DELETE ON config BEGIN
+                UPDATE config_version SET version = version + 1;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS plugin_config_insert AFTER INSERT ON plugin_config BEGIN
+                UPDATE config_version SET version = version + 1;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS plugin_config_update AFTER UPDATE ON plugin_config BEGIN
+                UPDATE config_version SET version = version + 1;
+            END''',
+            '''CREATE TRIGGER IF NOT EXISTS plugin_config_delete AFTER DELETE ON plugin_config BEGIN
+                UPDATE config_version SET version = version + 1;
+            END''',
+        ],
+        # 6 : Counter of the changes to the reference tables, so that the
+        # reference data kept in memory can be checked with a single row
+        [
+            "CREATE TABLE IF NOT EXISTS reference_version (version integer NOT NULL)",
+            "INSERT INTO reference_version SELECT 0 WHERE NOT EXISTS (SELECT * FROM reference_version)",
+        ] + [
+            '''CREATE TRIGGER IF NOT EXISTS %s_%s AFTER %s ON %s BEGIN
+                UPDATE reference_version SET version = version + 1;
+            END''' % (table, action.lower(), action, table)
+            for table in ["state", "food", "bowl", "care", "box"]
+            for action in ["INSERT", "UPDATE", "DELETE"]
+        ],
+        # 7 : Sheets by location, for get_box_occupancy()
+        [
+            "CREATE INDEX IF NOT EXISTS sheet_location_id ON sheet(location_id)",
+        ],
+    ]
+
+    # Small tables changing rarely, loaded entirely in memory by the reference
+    # data registry, with the method building their objects
+    reference_tables = {
+        State : "state_from_row",
+        Food : "food_from_row",
+        Bowl : "bowl_from_row",
+        Care : "care_from_row",
+        Box : "box_from_row"
+    }
+
+    # PRAGMA set by the performance profiles, applied in this order by
+    # connect()
+    pragmas = ["busy_timeout", "journal_mode", "synchronous", "cache_size",
+               "mmap_size", "temp_store"]
+
+    performance_profiles = {
+        # SQLite defaults
+        "default" : {},
+
+        # Readers don't block behind the writer, for deployments with
+        # several worker processes
+        "wal" : {
+            "busy_timeout" : 5000,
+            "journal_mode" : "WAL",
+            "synchronous" : "NORMAL",
+            "cache_size" : -16000,
+            "mmap_size" : 268435456,
+            "temp_store" : "MEMORY"
+        }
+    }
+
+    def __init__(self, identity_map = False, lazy_loading = False):
 
         self.plugins = []
         self.person_plugin = None
         self.con = None
 
+        # False if the plugins were loaded by another storage
+        self.__owns_plugins = True
+
+        # Serializes the calls to the plugins, which may be shared by storages
+        # used from several threads
+        self.plugin_lock = threading.RLock()
+
+        # True if the person plugin provides a person view on the connection
+        self.persons_attached = False
+
+        # Cached config and plugin_config tables, and the config_version they
+        # were read at. None until first read.
+        self.__config = None
+        self.__plugin_config = None
+        self.__config_version = None
+
+        # Objects of the reference_tables indexed by class then id, and the
+        # reference_version they were read at. None until first read.
+        self.__reference_data = None
+        self.__reference_version = None
+
+        # Number of nested transaction() blocks currently open
+        self.__transaction_depth = 0
+
+        # Number of nested read scopes currently open, and the caches checked
+        # against their version since the outermost one was entered
+        self.__read_depth = 0
+        self.__checked = set()
+
+        # If True, the identity map lives as long as the connection
+        self.identity_map = identity_map
+
+        # Objects already built in the current identity scope, indexed by
+        # (class, id). None outside of any scope.
+        self.__objects = None
+
+        # If True, the sheets and food habits of the animals are loaded only
+        # when first accessed
+        self.lazy_loading = lazy_loading
+
+        # Batch gathering the proxies created by the current list load
+        self.__lazy_batch = None
+
     def initialize(self):
         self.set_config("plugin_path", "plugins")
         # Set the default config values
@@ -210,33 +550,244 @@ class SQLiteStorage:
         #    return
 
         for path in plugin_paths.split(","):
-            sys.path.append(path)
+            if path not in sys.path:
+                sys.path.append(path)
             for module in [os.path.basename(file) for file in glob.glob(path + "/plugin_*.py")]:
                 self.__load_plugins_from_module(os.path.splitext(module)[0])
 
-    def connect(self, db_path):
+    def get_schema_version(self):
+        cursor = self.con.cursor()
+        cursor.execute("PRAGMA user_version")
+
+        return cursor.fetchone()[0]
+
+    def migrate(self):
+        '''
+        Applies all the migrations the database is missing. Each migration is
+        applied in its own transaction, along with the schema version update.
+        '''
+        cursor = self.con.cursor()
+
+        for version in range(self.get_schema_version(), len(SQLiteStorage.migrations)):
+            with self.transaction():
+                # DDL statements don't start a transaction implicitly
+                if not self.con.in_transaction:
+                    cursor.execute("BEGIN")
+
+                for statement in SQLiteStorage.migrations[version]:
+                    if callable(statement):
+                        statement(self)
+                    else:
+                        cursor.execute(statement)
+
+                cursor.execute("PRAGMA user_version = %d" % (version + 1))
+
+            # The configuration read before may lack its version
+            self.__config = None
+            self.__reference_data = None
+
+    def share_plugins(self, storage):
+        '''
+        Uses the plugins already loaded and registered by another storage
+        instead of loading them again. The plugins stay owned by that storage,
+        which is the only one to destroy them.
+        '''
+        self.plugins = storage.plugins
+        self.person_plugin = storage.person_plugin
+        self.plugin_lock = storage.plugin_lock
+        self.__owns_plugins = False
+
+        self.attach_persons()
+
+    def attach_persons(self):
+        '''
+        Lets the person plugin attach its database to the connection, if it
+        can, so that queries can join the person view (id, name, type)
+        '''
+        if self.person_plugin is None or \
+           not hasattr(self.person_plugin, "attach"):
+            return False
+
+        # Databases can't be attached within a transaction
+        self.con.commit()
+
+        with self.plugin_lock:
+            self.persons_attached = self.person_plugin.attach(self.con)
+
+        return self.persons_attached
+
+    def get_pragmas(self):
+        '''
+        Returns the PRAGMA values of the performance profile set in the
+        "performance_profile" config key, each of them being overriden by the
+        "pragma_<name>" config key, if any.
+        '''
+        profile = self.get_config("performance_profile")
+        if profile is None:
+            profile = "default"
+
+        if profile not in SQLiteStorage.performance_profiles:
+            raise ValueError("Unknown performance profile %s" % profile)
+
+        values = dict(SQLiteStorage.performance_profiles[profile])
+
+        for pragma in SQLiteStorage.pragmas:
+            value = self.get_config("pragma_" + pragma)
+            if value is not None:
+                values[pragma] = value
+
+        return values
+
+    def __apply_pragmas(self):
+        values = self.get_pragmas()
+        cursor = self.con.cursor()
+
+        for pragma in SQLiteStorage.pragmas:
+            if pragma not in values:
+                continue
+
+            # PRAGMA values can't be bound as query parameters
+            value = str(values[pragma])
+            if not value.lstrip("-").isalnum():
+                raise ValueError("Invalid value %s for PRAGMA %s" % (value, pragma))
+
+            cursor.execute("PRAGMA " + pragma + " = " + value)
+
+    def connect(self, db_path, with_plugins = True, profile = None,
+                check_same_thread = True):
+        '''
+        Connects to the database, creating it if needed.
+
+        If profile is given, it is stored as the performance profile of the
+        database. Otherwise, the one previously stored is used.
+
+        If check_same_thread is False, the connection may be used by another
+        thread than the one creating it, as long as only one thread uses it at
+        a time.
+        '''
         needs_init = False
 
         if not os.path.isfile(db_path):
             self.__create(db_path)
             needs_init = True
 
-        self.con = sqlite3.connect(db_path)
+        # URI filenames let plugins attach their databases read-only, plain
+        # paths are opened as before
+        self.con = sqlite3.connect(db_path, check_same_thread = check_same_thread,
+                                   uri = True)
         self.con.row_factory = sqlite3.Row
 
+        if profile is not None and profile != self.get_config("performance_profile"):
+            if profile not in SQLiteStorage.performance_profiles:
+                self.con.close()
+                raise ValueError("Unknown performance profile %s" % profile)
+
+            self.set_config("performance_profile", profile)
+
+        self.__apply_pragmas()
+
+        if self.identity_map:
+            self.__objects = {}
+
         if needs_init:
             self.initialize()
 
-        self.load_plugins()
-        self.register_plugins()
+        self.migrate()
+
+        if with_plugins:
+            self.load_plugins()
+            self.register_plugins()
+            self.attach_persons()
 
     def close(self):
         self.con.commit()
+        self.__lazy_batch = None
+
+        # Let SQLite update the statistics of the tables that need it
+        self.con.execute("PRAGMA optimize")
         self.con.close()
+        self.__objects = None
 
-        if self.person_plugin is not None:
+        if self.person_plugin is not None and self.__owns_plugins:
             self.person_plugin.destroy()
 
+    @contextmanager
+    def transaction(self):
+        '''
+        Groups all the writes done within this block in a single commit. If an
+        exception is raised, all of them are rolled back and the identity map
+        is cleared, since it may hold objects that were never written.
+
+        Nested blocks are part of the outermost one, which is the only one to
+        commit or roll back. Outside of any block, each write is commited
+        right away.
+
+        The configuration and reference data kept in memory are checked
+        against the database once per block, instead of on each read.
+        '''
+        self.__transaction_depth += 1
+
+        try:
+            with self.__read_scope():
+                yield self
+        except BaseException:
+            self.__transaction_depth -= 1
+            if self.__transaction_depth == 0:
+                self.rollback()
+            raise
+
+        self.__transaction_depth -= 1
+        if self.__transaction_depth == 0:
+            self.con.commit()
+
+    @contextmanager
+    def __read_scope(self):
+        '''
+        Within this scope, the caches kept in memory are checked against their
+        version in the database only once, on first use. Outside of any scope,
+        they are checked on each read.
+        '''
+        self.__read_depth += 1
+        try:
+            yield
+        finally:
+            self.__read_depth -= 1
+            if self.__read_depth == 0:
+                self.__checked = set()
+
+    def __needs_check(self, cache):
+        '''
+        Returns True if the given cache must be checked against its version
+        before being read
+        '''
+        if cache in self.__checked:
+            return False
+
+        if self.__read_depth > 0:
+            self.__checked.add(cache)
+
+        return True
+
+    def __commit(self):
+        if self.__transaction_depth == 0:
+            self.con.commit()
+
+    def rollback(self):
+        '''
+        Rolls back the pending changes. Everything kept in memory is dropped,
+        since it may hold changes that were never written.
+        '''
+        self.con.rollback()
+        self.clear_identity_map()
+        self.__config = None
+        self.__reference_data = None
+
+    def clear_identity_map(self):
+        '''
+        Drops all the objects kept by the identity map of the connection
+        '''
+        self.__objects = {} if self.identity_map else None
+
     def get_last_inserted_id(self, table):
             cursor = self.con.cursor()
             query = "SELECT seq FROM sqlite_sequence WHERE name = ?"
@@ -268,19 +819,111 @@ class SQLiteStorage:
     def food_from_row(self, row):
         return self.__type_from_row(Food, row)
 
-    def __get_all(self, cls, get_from_row):
+    @classmethod
+    def date_to_sql(cls, d):
+        '''
+        Returns the ISO 8601 text a date or time is stored as, None if d is
+        None
+        '''
+        return d.isoformat() if d is not None else None
+
+    @classmethod
+    def date_from_sql(cls, text, type_cls = date):
+        '''
+        Returns the date, or time, stored as text. Missing values are NULL,
+        or '' in databases written before schema version 4.
+        '''
+        return type_cls.fromisoformat(text) if text else None
+
+    @classmethod
+    def forge_query_date_range(cls, field, start, end, where = False):
+        '''
+        Returns the condition selecting the rows whose date field is between
+        start and end included, either of them being None for an open range.
+        where tells if the query already has a WHERE clause.
+        '''
+        clauses = [field + " IS NOT NULL"]
+        values = []
+
+        if start is not None:
+            clauses.append(field + " >= ?")
+            values.append(SQLiteStorage.date_to_sql(start))
+
+        if end is not None:
+            clauses.append(field + " <= ?")
+            values.append(SQLiteStorage.date_to_sql(end))
+
+        return [("AND " if where else "WHERE ") + " AND ".join(clauses), values]
+
+    # Number of objects loaded at once by the iter_all_*() methods
+    iter_chunk_size = 500
+
+    @classmethod
+    def forge_query_page(cls, id_field, limit, after_id, where = False):
+        '''
+        Returns the end of a query selecting the page of at most limit rows
+        coming after the one with id after_id, ordered by id_field. where
+        tells if the query already has a WHERE clause.
+        '''
+        clauses = []
+        values = []
+
+        if after_id is not None:
+            clauses.append(("AND " if where else "WHERE ") + id_field + " > ?")
+            values.append(after_id)
+
+        clauses.append("ORDER BY " + id_field)
+
+        if limit is not None:
+            clauses.append("LIMIT ?")
+            values.append(limit)
+
+        return [" ".join(clauses), values]
+
+    def __iter_pages(self, get_all, chunk_size, *args):
+        '''
+        Yields all the objects returned by the get_all method, loading them
+        page by page so that at most chunk_size of them are held at once.
+        '''
+        if chunk_size is None:
+            chunk_size = SQLiteStorage.iter_chunk_size
+
+        after_id = None
+
+        while True:
+            with self.__page_scope():
+                page = get_all(*args, limit = chunk_size, after_id = after_id)
+
+            yield from page
+
+            if len(page) < chunk_size:
+                return
+
+            after_id = page[-1].id
+
+    def __get_all(self, cls, get_from_row, limit = None, after_id = None):
         table = SQLiteStorage.tables[cls]
-        query = "SELECT * FROM " + table
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id)
+        query = "SELECT * FROM " + table + " " + page
         from_row = getattr(self, get_from_row)
         elems = []
 
         cursor = self.con.cursor()
-        for row in cursor.execute(query):
-            elems.append(from_row(row))
+        with self.__read_scope():
+            for row in cursor.execute(query, values):
+                elem = self.__lookup(cls, row['id'])
+                if elem is None:
+                    elem = from_row(row)
+                    self.__remember(elem)
+
+                elems.append(elem)
 
         return elems
 
     def __get_by_id(self, cls, get_from_row, id):
+        if self.__is_known(cls, id):
+            return self.__lookup(cls, id)
+
         table = SQLiteStorage.tables[cls]
         query = "SELECT * FROM " + table + " WHERE id = ?"
         from_row = getattr(self, get_from_row)
@@ -292,33 +935,437 @@ class SQLiteStorage:
         if row is None:
             return None
 
-        return from_row(row)
+        obj = from_row(row)
+        self.__remember(obj)
+
+        return obj
+
+    # Maximum number of ids bound in a single IN (...) query, to stay below
+    # SQLITE_MAX_VARIABLE_NUMBER on older SQLite versions
+    max_ids_per_query = 500
+
+    def _get_rows_by_ids(self, table, ids, columns = "*", id_field = "id"):
+        '''
+        Returns all the rows of the given table whose id is in ids, using as
+        few queries as possible. table may also be a join, with the selected
+        columns and the id field given explicitly.
+        '''
+        ids = list(ids)
+        rows = []
+
+        cursor = self.con.cursor()
+        for i in range(0, len(ids), SQLiteStorage.max_ids_per_query):
+            chunk = ids[i:i + SQLiteStorage.max_ids_per_query]
+            query = "SELECT " + columns + " FROM " + table + " WHERE " + \
+                    id_field + " IN (" + ", ".join(["?"] * len(chunk)) + ")"
+            rows.extend(cursor.execute(query, chunk).fetchall())
+
+        return rows
+
+    @classmethod
+    def __identity_key(cls, obj_cls, id):
+        # All the animals share the ids of the animal table, whatever their
+        # species
+        if issubclass(obj_cls, Animal):
+            obj_cls = Animal
+
+        # Ids coming from forms are strings
+        try:
+            return (obj_cls, int(id))
+        except (TypeError, ValueError):
+            return (obj_cls, id)
+
+    def __is_known(self, cls, id):
+        if self.__objects is None:
+            return False
+
+        return SQLiteStorage.__identity_key(cls, id) in self.__objects
+
+    def __lookup(self, cls, id):
+        '''
+        Returns the object of class cls with the given id if it was already
+        built in the current identity scope, None otherwise.
+        '''
+        if self.__objects is None:
+            return None
+
+        return self.__objects.get(SQLiteStorage.__identity_key(cls, id))
+
+    def __remember(self, obj, cls = None, id = None):
+        if self.__objects is None:
+            return
+
+        if obj is not None:
+            cls = type(obj)
+            id = obj.id
+
+        self.__objects[SQLiteStorage.__identity_key(cls, id)] = obj
+
+    def __forget(self, obj):
+        if self.__objects is None:
+            return
+
+        self.__objects.pop(SQLiteStorage.__identity_key(type(obj), obj.id), None)
+
+    @contextmanager
+    def __page_scope(self):
+        '''
+        Within this scope, the objects already kept by the identity scope are
+        reused, but the new ones are only kept until the scope exits. The
+        iter_all_*() methods build each page in such a scope, so that going
+        through a whole table doesn't keep all of it in memory.
+        '''
+        if self.__objects is None:
+            yield
+            return
+
+        objects = self.__objects
+        self.__objects = ChainMap({}, objects)
+        page_objects = self.__objects
+        try:
+            yield
+        finally:
+            # Unless the identity map was cleared meanwhile
+            if self.__objects is page_objects:
+                self.__objects = objects
+
+    @contextmanager
+    def identity_scope(self):
+        '''
+        Within this scope, each (class, id) pair is built only once : the
+        objects loaded from the database are kept and returned again by the
+        following get_*() calls instead of being queried again.
+
+        Scopes can be nested, only the outermost one clears the objects on
+        exit. If the storage was created with identity_map = True, the scope is
+        the whole connection.
 
-    def get_all_states(self):
-        return self.__get_all(State, "state_from_row")
+        The reference data is checked against the database once per scope.
+        '''
+        if self.__objects is not None:
+            with self.__read_scope():
+                yield
+            return
+
+        self.__objects = {}
+        try:
+            with self.__read_scope():
+                yield
+        finally:
+            self.__objects = None
+
+    def __fetch_missing_rows(self, cls, ids):
+        '''
+        Returns the ids of cls that are not known yet in the current identity
+        scope, along with their rows.
+        '''
+        ids = set(id for id in ids if id is not None and id != '')
+        ids = [id for id in ids if not self.__is_known(cls, id)]
+
+        rows = self._get_rows_by_ids(SQLiteStorage.tables[cls],
+                                     [id for id in ids if id > 0])
+
+        return [ids, rows]
+
+    def __remember_rows(self, cls, get_from_row, ids, rows):
+        '''
+        Builds the objects from rows and keeps them in the current identity
+        scope. Ids without any matching row are remembered as None, so that
+        they are not queried again either.
+        '''
+        for id in ids:
+            self.__remember(None, cls, id)
+
+        from_row = getattr(self, get_from_row)
+        for row in rows:
+            self.__remember(from_row(row))
+
+    def __prefetch_sheets(self, ids):
+        '''
+        Loads the given sheets with their locations and persons, with a fixed
+        number of queries whatever the number of ids. States and boxes come
+        from the reference data.
+        '''
+        [sheet_ids, sheet_rows] = self.__fetch_missing_rows(Sheet, ids)
+
+        self.__prefetch_locations([row['location_id'] for row in sheet_rows])
+        self.__remember_rows(Sheet, "sheet_from_row", sheet_ids, sheet_rows)
+
+    def __prefetch_locations(self, ids):
+        '''
+        Loads the given locations with their persons, with a fixed number of
+        queries whatever the number of ids. Boxes come from the reference data.
+        '''
+        [location_ids, location_rows] = self.__fetch_missing_rows(Location, ids)
+
+        self.__prefetch_persons([row['person_id'] for row in location_rows])
+
+        self.__remember_rows(Location, "location_from_row", location_ids,
+                             location_rows)
+
+    def __prefetch_foodhabits(self, ids):
+        '''
+        Loads the given food habits with a fixed number of queries whatever
+        the number of ids. Foods and bowls come from the reference data.
+        '''
+        [foodhabit_ids, foodhabit_rows] = self.__fetch_missing_rows(FoodHabit,
+                                                                    ids)
+        self.__remember_rows(FoodHabit, "foodhabit_from_row", foodhabit_ids,
+                             foodhabit_rows)
+
+    def __prefetch_animal_relations(self, rows):
+        '''
+        Loads everything referenced by a list of animal rows (sheets and their
+        states, locations and boxes, food habits and their foods and bowls)
+        with a fixed number of queries, whatever the number of rows.
+        '''
+        sheet_ids = []
+        for row in rows:
+            sheet_ids.append(row['arrival_sheet_id'])
+            sheet_ids.append(row['latest_sheet_id'])
+
+        self.__prefetch_sheets(sheet_ids)
+        self.__prefetch_foodhabits([row['food_habit_id'] for row in rows])
+
+    def __load_references(self, cls, ids):
+        '''
+        Loads the objects behind a batch of lazy proxies, returns them indexed
+        by id
+        '''
+        with self.identity_scope():
+            if cls is Sheet:
+                self.__prefetch_sheets(ids)
+            else:
+                self.__prefetch_foodhabits(ids)
+
+            return {id : self.__lookup(cls, id) for id in ids}
+
+    @contextmanager
+    def __lazy_scope(self):
+        '''
+        All the proxies created within this scope are loaded together
+        '''
+        if self.__lazy_batch is not None:
+            yield
+            return
+
+        self.__lazy_batch = _LazyBatch(self.__load_references)
+        try:
+            yield
+        finally:
+            self.__lazy_batch = None
+
+    def __reference(self, cls, id, on_load = None):
+        '''
+        Returns a proxy to the object of class cls with the given id, or the
+        object itself if it is already known
+        '''
+        if id is None or id == '' or id <= 0:
+            return None
+
+        obj = self.__lookup(cls, id)
+        if obj is not None:
+            if on_load is not None:
+                on_load(obj)
+            return obj
+
+        with self.__lazy_scope():
+            return self.__lazy_batch.reference(cls, id, on_load)
+
+    def __foodhabit_from_id(self, id):
+        if self.lazy_loading:
+            return self.__reference(FoodHabit, id)
+
+        return self.get_foodhabit_by_id(id) if id != '' else None
+
+    def __build_animals(self, rows, get_from_row):
+        '''
+        Builds and links the animals described by rows, loading all their
+        relations in a fixed number of queries.
+        '''
+        from_row = getattr(self, get_from_row)
+        animals = []
+
+        with self.identity_scope(), self.__lazy_scope():
+            if not self.lazy_loading:
+                new_rows = [row for row in rows
+                            if self.__lookup(Animal, row['id']) is None]
+                self.__prefetch_animal_relations(new_rows)
+
+            for row in rows:
+                animal = self.__lookup(Animal, row['id'])
+
+                if animal is None:
+                    animal = from_row(row)
+                    self.__link_animal_sheets(animal, row['arrival_sheet_id'],
+                                              row['latest_sheet_id'])
+                    self.__remember(animal)
+
+                animals.append(animal)
+
+        return animals
+
+    def __get_reference_version(self):
+        cursor = self.con.cursor()
+
+        try:
+            cursor.execute("SELECT version FROM reference_version")
+        except sqlite3.OperationalError:
+            # The database is not migrated yet
+            return None
+
+        return cursor.fetchone()[0]
+
+    def __load_reference_data(self, version):
+        self.__reference_data = {}
+        cursor = self.con.cursor()
+
+        for cls, get_from_row in SQLiteStorage.reference_tables.items():
+            from_row = getattr(self, get_from_row)
+            query = "SELECT * FROM " + SQLiteStorage.tables[cls] + " ORDER BY id"
+
+            self.__reference_data[cls] = {}
+            for row in cursor.execute(query):
+                obj = from_row(row)
+
+                # Keep the objects already known in the current identity scope,
+                # with the values read
+                known = self.__lookup(cls, row['id'])
+                if known is not None:
+                    SQLiteStorage.__copy_fields(obj, known)
+                    obj = known
+
+                self.__reference_data[cls][row['id']] = obj
+
+        self.__reference_version = version
+
+    @classmethod
+    def __copy_fields(cls, source, target):
+        for klass in type(source).__mro__:
+            for field in getattr(klass, "__slots__", ()):
+                setattr(target, field, getattr(source, field))
+
+    def check_reference_data(self):
+        '''
+        Reloads the states, foods, bowls, cares and boxes kept in memory if
+        another connection changed them since they were read, with a single
+        query if none did. Done before each read, or once per transaction()
+        block or identity scope.
+        '''
+        version = self.__get_reference_version()
+
+        if self.__reference_data is None or version is None or \
+           version != self.__reference_version:
+            self.__load_reference_data(version)
+
+    def __get_references(self, cls):
+        if self.__needs_check("reference") or self.__reference_data is None:
+            self.check_reference_data()
+
+        return self.__reference_data[cls]
+
+    def __get_reference_by_id(self, cls, id):
+        # Ids coming from forms are strings
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            return None
+
+        return self.__get_references(cls).get(id)
+
+    def __get_all_references(self, cls, limit = None, after_id = None):
+        # Loaded ordered by id, and new objects get the greatest ids
+        objs = list(self.__get_references(cls).values())
+
+        if after_id is not None:
+            objs = [obj for obj in objs if obj.id > after_id]
+
+        if limit is not None:
+            objs = objs[:limit]
+
+        return objs
+
+    def __reference_written(self, objs, changes, deleted = False):
+        '''
+        Updates the reference data kept in memory after objs were written,
+        before the write is commited. changes is the number of rows written,
+        each of them bumping the version by one.
+
+        If the version moved further, other connections changed the reference
+        tables since they were read : the reference data misses their changes
+        and is dropped.
+        '''
+        if self.__reference_data is None:
+            return
+
+        objs = [obj for obj in objs if type(obj) in SQLiteStorage.reference_tables]
+        if len(objs) == 0:
+            return
+
+        version = self.__get_reference_version()
+        if self.__reference_version is None or \
+           version != self.__reference_version + changes:
+            self.__reference_data = None
+            return
+
+        self.__reference_version = version
+
+        if deleted:
+            for obj in objs:
+                self.__reference_data[type(obj)].pop(obj.id, None)
+            return
+
+        # The written objects are kept with the values stored, e.g. numbers
+        # given as strings by forms are read back as numbers
+        groups = {}
+        for obj in objs:
+            groups.setdefault(type(obj), []).append(obj)
+
+        for cls, cls_objs in groups.items():
+            from_row = getattr(self, SQLiteStorage.reference_tables[cls])
+            stored = {row['id'] : from_row(row) for row in
+                      self._get_rows_by_ids(SQLiteStorage.tables[cls],
+                                            [obj.id for obj in cls_objs])}
+
+            for obj in cls_objs:
+                if obj.id in stored:
+                    SQLiteStorage.__copy_fields(stored[obj.id], obj)
+                    self.__reference_data[cls][obj.id] = obj
+
+    def get_all_states(self, limit = None, after_id = None):
+        return self.__get_all_references(State, limit, after_id)
+
+    def iter_all_states(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_states, chunk_size)
 
     def get_state_by_id(self, id):
-        return self.__get_by_id(State, "state_from_row", id)
+        return self.__get_reference_by_id(State, id)
 
-    def get_all_foods(self):
-        return self.__get_all(Food, "food_from_row")
+    def get_all_foods(self, limit = None, after_id = None):
+        return self.__get_all_references(Food, limit, after_id)
+
+    def iter_all_foods(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_foods, chunk_size)
 
     def get_food_by_id(self, id):
-        return self.__get_by_id(Food, "food_from_row", id)
+        return self.__get_reference_by_id(Food, id)
+
+    def get_all_bowls(self, limit = None, after_id = None):
+        return self.__get_all_references(Bowl, limit, after_id)
 
-    def get_all_bowls(self):
-        return self.__get_all(Bowl, "bowl_from_row")
+    def iter_all_bowls(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_bowls, chunk_size)
 
     def get_bowl_by_id(self, id):
-        return self.__get_by_id(Bowl, "bowl_from_row", id)
+        return self.__get_reference_by_id(Bowl, id)
 
     @classmethod
     def params_animal(cls, animal):
         return {
                 "species_id" : animal.species,
                 "name" : animal.name,
-                "birth_date" : animal.birth_date.isoformat() if animal.birth_date is not None else "",
-                "arrival_date" : animal.arrival_date.isoformat() if animal.arrival_date is not None else "",
+                "birth_date" : SQLiteStorage.date_to_sql(animal.birth_date),
+                "arrival_date" : SQLiteStorage.date_to_sql(animal.arrival_date),
                 "arrival_sheet_id" : animal.arrival_sheet.id if animal.arrival_sheet is not None else -1,
                 "latest_sheet_id" : animal.latest_sheet.id if animal.latest_sheet is not None else -1,
                 "gender" : animal.gender,
@@ -337,8 +1384,8 @@ class SQLiteStorage:
             id = row['id'],
             species = row['species_id'],
             name = row['name'],
-            birth_date = date.fromisoformat(row['birth_date']) if row['birth_date'] is not '' else None,
-            arrival_date = date.fromisoformat(row['arrival_date']) if row['arrival_date'] is not '' else None,
+            birth_date = SQLiteStorage.date_from_sql(row['birth_date']),
+            arrival_date = SQLiteStorage.date_from_sql(row['arrival_date']),
             arrival_sheet = None,
             latest_sheet = None,
             gender = row['gender'],
@@ -349,79 +1396,175 @@ class SQLiteStorage:
             implant = row['implant'],
             neutered = row['neutered'],
             history = row['history'],
-            food_habits = self.get_foodhabit_by_id(row['food_habit_id']) if row['food_habit_id'] is not '' else None,
+            food_habits = self.__foodhabit_from_id(row['food_habit_id']),
         )
 
-    def get_all_animals_by_species(self, species):
+    def get_all_animals_by_species(self, species, limit = None, after_id = None):
 
         #Dogs and Cats have a specific treatment
         if species == Species.DOG:
-            return self.get_all_dogs()
+            return self.get_all_dogs(limit, after_id)
 
         if species == Species.CAT:
-            return self.get_all_cats()
+            return self.get_all_cats(limit, after_id)
 
-        query = "SELECT * FROM animal WHERE species_id = ?"
-        animals = []
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id, True)
+        query = "SELECT * FROM animal WHERE species_id = ? " + page
 
         cursor = self.con.cursor()
+        rows = cursor.execute(query, [species] + values).fetchall()
 
-        for row in cursor.execute(query, [species]):
-            animal = self.animal_from_row(row)
-            self.__link_animal(animal)
-            animals.append(animal)
+        return self.__build_animals(rows, "animal_from_row")
 
-        return animals
+    def iter_all_animals_by_species(self, species, chunk_size = None):
+        return self.__iter_pages(self.get_all_animals_by_species, chunk_size, species)
 
-    def get_all_animals(self):
-        animals = []
-        for species in Species:
-            animals.extend(self.get_all_animals_by_species(species))
+    def get_all_animals(self, limit = None, after_id = None):
+        '''
+        Returns all the animals ordered by id, each one with the class of its
+        species
+        '''
+        [page, values] = SQLiteStorage.forge_query_page("animal.id", limit, after_id)
+        query = "SELECT " + SQLiteStorage.animal_species_columns + \
+                " FROM " + SQLiteStorage.animal_species_table + " " + page
 
-        return animals
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
 
-    def get_all_animals_by_box_id(self, id):
-        animals = []
+        return self.__build_any_animals(rows)
+
+    def iter_all_animals(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_animals, chunk_size)
+
+    def get_all_animals_by_arrival_date(self, start = None, end = None):
+        '''
+        Returns the animals arrived between start and end included, ordered by
+        arrival date
+        '''
+        [where, values] = SQLiteStorage.forge_query_date_range(
+                                    "animal.arrival_date", start, end)
+        query = "SELECT " + SQLiteStorage.animal_species_columns + \
+                " FROM " + SQLiteStorage.animal_species_table + " " + where + \
+                " ORDER BY animal.arrival_date, animal.id"
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        return self.__build_any_animals(rows)
+
+    def get_all_animals_by_box_id(self, id, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("animal.id", limit, after_id, True)
         query = '''
         SELECT animal.id FROM animal
         LEFT JOIN sheet ON animal.latest_sheet_id = sheet.id
         LEFT JOIN location ON sheet.location_id = location.id
         LEFT JOIN box ON location.box_id = box.id
         WHERE location.location_type = ? AND box.id = ?
-        '''
+        ''' + page
 
         cursor = self.con.cursor()
-        cursor.execute(query, [LocationType.BOX, id])
+        cursor.execute(query, [LocationType.BOX, id] + values)
 
         rows = cursor.fetchall()
 
-        for row in rows:
-            animals.append(self.get_animal_by_id(row['id']))
+        return self.get_animals_by_ids([row['id'] for row in rows])
 
-        return animals
+    def iter_all_animals_by_box_id(self, id, chunk_size = None):
+        return self.__iter_pages(self.get_all_animals_by_box_id, chunk_size, id)
 
-    def __get_animal_by_id_simple(self, id):
-        # Try to get a dog
-        animal = self.__get_dog_by_id_simple(id)
-        if animal is not None:
-            return animal
+    # Maximum number of animals returned by search_animals()
+    search_limit = 50
 
-        # Try to get a cat
-        animal = self.__get_cat_by_id_simple(id)
-        if animal is not None:
-            return animal
+    @classmethod
+    def forge_match_query(cls, text):
+        '''
+        Turns free text into an FTS5 query matching the animals having all of
+        its words, each one possibly being the beginning of a longer word.
+        Returns None if the text has no word.
+        '''
+        words = re.findall(r"\w+", text)
+
+        if len(words) == 0:
+            return None
+
+        return " ".join('"' + word + '"*' for word in words)
+
+    def search_animals(self, query, species = None, limit = None):
+        '''
+        Returns the Dog, Cat or Animal whose name, breed, color, character or
+        history match the words of query, the most relevant ones first
+        '''
+        match = SQLiteStorage.forge_match_query(query)
+
+        if match is None:
+            return []
+
+        if limit is None:
+            limit = SQLiteStorage.search_limit
+
+        values = [match]
+        query = "SELECT " + SQLiteStorage.animal_species_columns + \
+                " FROM " + SQLiteStorage.animal_species_table + \
+                " JOIN animal_fts ON animal_fts.rowid = animal.id" \
+                " WHERE animal_fts MATCH ?"
+
+        if species is not None:
+            query += " AND animal.species_id = ?"
+            values.append(species)
 
-        # This is not a dog nor a cat, so build a generic animal
-        query = "SELECT * FROM animal WHERE id = ?"
+        query += " ORDER BY animal_fts.rank LIMIT ?"
+        values.append(limit)
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        return self.__build_any_animals(rows)
+
+    # Columns and join reading an animal along with its species specific
+    # columns, whatever its species. Only the first row of the table of its
+    # species is joined, so that stray rows never return an animal twice.
+    animal_species_columns = '''animal.*, dog.id AS dog_id, dog.category,
+                    dog.ok_cats, cat.id AS cat_id, cat.has_fiv, cat.has_felv'''
+    animal_species_table = '''animal
+                    LEFT JOIN dog ON animal.species_id = %d AND dog.id =
+                        (SELECT MIN(id) FROM dog WHERE animal_id = animal.id)
+                    LEFT JOIN cat ON animal.species_id = %d AND cat.id =
+                        (SELECT MIN(id) FROM cat WHERE animal_id = animal.id)''' % \
+                    (Species.DOG, Species.CAT)
+
+    @classmethod
+    def animal_from_row_method(cls, row):
+        '''
+        Returns the name of the method building the animal of a row read from
+        animal_species_table, according to its species
+        '''
+        if row['species_id'] == Species.DOG and row['dog_id'] is not None:
+            return "dog_from_row"
+
+        if row['species_id'] == Species.CAT and row['cat_id'] is not None:
+            return "cat_from_row"
+
+        return "animal_from_row"
+
+    def __get_animal_row(self, id):
+        query = "SELECT " + SQLiteStorage.animal_species_columns + \
+                " FROM " + SQLiteStorage.animal_species_table + \
+                " WHERE animal.id = ?"
 
         cursor = self.con.cursor()
         cursor.execute(query, [id])
-        row = cursor.fetchone()
+
+        return cursor.fetchone()
+
+    def __get_animal_by_id_simple(self, id):
+        row = self.__get_animal_row(id)
 
         if row is None:
             return None
 
-        return self.animal_from_row(row)
+        from_row = getattr(self, SQLiteStorage.animal_from_row_method(row))
+
+        return from_row(row)
 
     def __link_animal(self, animal):
 
@@ -438,6 +1581,24 @@ class SQLiteStorage:
         cursor.execute(query, [animal.id])
         [arrival_sheet_id, latest_sheet_id] = cursor.fetchone()
 
+        self.__link_animal_sheets(animal, arrival_sheet_id, latest_sheet_id)
+
+    def __link_animal_sheets(self, animal, arrival_sheet_id, latest_sheet_id):
+
+        if self.lazy_loading:
+            def on_load(sheet):
+                sheet.animal = animal
+
+            animal.arrival_sheet = self.__reference(Sheet, arrival_sheet_id,
+                                                    on_load)
+
+            if latest_sheet_id == arrival_sheet_id:
+                animal.latest_sheet = animal.arrival_sheet
+            else:
+                animal.latest_sheet = self.__reference(Sheet, latest_sheet_id,
+                                                       on_load)
+            return
+
         if arrival_sheet_id is not None and arrival_sheet_id > 0:
             animal.arrival_sheet = self.__get_sheet_by_id_simple(arrival_sheet_id)
             animal.arrival_sheet.animal = animal
@@ -447,21 +1608,131 @@ class SQLiteStorage:
             animal.latest_sheet.animal = animal
 
     def get_animal_by_id(self, id):
-        # Try to get a dog
-        animal = self.get_dog_by_id(id)
-        if animal is not None:
-            return animal
+        if self.__is_known(Animal, id):
+            return self.__lookup(Animal, id)
 
-        # Try to get a cat
-        animal = self.get_cat_by_id(id)
-        if animal is not None:
-            return animal
+        row = self.__get_animal_row(id)
+        if row is None:
+            return None
+
+        from_row = getattr(self, SQLiteStorage.animal_from_row_method(row))
+
+        # The arrival sheet is often the latest one too
+        with self.identity_scope():
+            animal = from_row(row)
+            self.__link_animal_sheets(animal, row['arrival_sheet_id'],
+                                      row['latest_sheet_id'])
+
+        self.__remember(animal)
+
+        return animal
+
+    def get_animals_by_ids(self, ids):
+        '''
+        Returns the Dog, Cat or Animal of each of the given ids, in the same
+        order, leaving out the ids without any animal. The animals of each
+        species are built together, with a fixed number of queries.
+        '''
+        with self.identity_scope():
+            missing = set(id for id in ids if not self.__is_known(Animal, id))
+            rows = self._get_rows_by_ids(SQLiteStorage.animal_species_table,
+                                         missing,
+                                         SQLiteStorage.animal_species_columns,
+                                         "animal.id")
+            self.__build_any_animals(rows)
+
+            animals = [self.__lookup(Animal, id) for id in ids]
+
+        return [animal for animal in animals if animal is not None]
+
+    def __build_any_animals(self, rows):
+        '''
+        Builds the animals described by rows read from animal_species_table,
+        each one with the class of its species, and returns them in the same
+        order. The relations of all of them are loaded together.
+        '''
+        with self.identity_scope():
+            if not self.lazy_loading:
+                self.__prefetch_animal_relations(
+                    [row for row in rows
+                     if self.__lookup(Animal, row['id']) is None])
+
+            groups = {}
+            for row in rows:
+                method = SQLiteStorage.animal_from_row_method(row)
+                groups.setdefault(method, []).append(row)
+
+            for method in groups:
+                self.__build_animals(groups[method], method)
+
+            return [self.__lookup(Animal, row['id']) for row in rows]
+
+    def get_duplicate_implants(self):
+        '''
+        Returns the implants used by several animals, each one with the list
+        of the ids of these animals
+        '''
+        query = '''
+            SELECT implant, GROUP_CONCAT(id) AS ids FROM animal
+            WHERE implant != ''
+            GROUP BY implant HAVING COUNT(*) > 1
+        '''
+
+        cursor = self.con.cursor()
+        return {row['implant'] : [int(id) for id in row['ids'].split(',')]
+                for row in cursor.execute(query)}
+
+    def enforce_unique_implants(self):
+        '''
+        Makes the animal_implant index unique, so that two animals can't have
+        the same implant. If some implants are already duplicated, they are
+        logged and returned, and the index is a plain one until they are fixed
+        and this method is called again.
+        '''
+        duplicates = self.get_duplicate_implants()
+        cursor = self.con.cursor()
+
+        with self.transaction():
+            # DDL statements don't start a transaction implicitly
+            if not self.con.in_transaction:
+                cursor.execute("BEGIN")
+
+            if len(duplicates) > 0:
+                for implant, ids in duplicates.items():
+                    logging.warning("Implant %s used by the animals %s", implant,
+                                    ", ".join(str(id) for id in ids))
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS animal_implant "
+                               "ON animal(implant) WHERE implant != ''")
+                return duplicates
+
+            cursor.execute("DROP INDEX IF EXISTS animal_implant")
+            cursor.execute("CREATE UNIQUE INDEX animal_implant "
+                           "ON animal(implant) WHERE implant != ''")
+
+        return {}
+
+    def get_animal_by_implant(self, implant):
+        '''
+        Returns the Dog, Cat or Animal with the given microchip implant number,
+        None if there is none
+        '''
+        implant = implant.strip()
+
+        if implant == '':
+            return None
+
+        # The implant != '' term lets SQLite use the partial index
+        query = "SELECT id FROM animal WHERE implant = ? AND implant != ''"
+
+        cursor = self.con.cursor()
+        cursor.execute(query, [implant])
+        row = cursor.fetchone()
 
-        animal = self.__get_animal_by_id_simple(id)
-        if animal is not None:
-            self.__link_animal(animal)
+        if row is None:
+            return None
 
-        return animal
+        return self.get_animal_by_id(row['id'])
 
     @classmethod
     def params_dog(cls, dog):
@@ -475,8 +1746,8 @@ class SQLiteStorage:
             id = row['id'],
             species = row['species_id'],
             name = row['name'],
-            birth_date = date.fromisoformat(row['birth_date']) if row['birth_date'] is not '' else None,
-            arrival_date = date.fromisoformat(row['arrival_date']) if row['arrival_date'] is not '' else None,
+            birth_date = SQLiteStorage.date_from_sql(row['birth_date']),
+            arrival_date = SQLiteStorage.date_from_sql(row['arrival_date']),
             arrival_sheet = None,
             latest_sheet = None,
             gender = row['gender'],
@@ -487,26 +1758,24 @@ class SQLiteStorage:
             implant = row['implant'],
             neutered = row['neutered'],
             history = row['history'],
-            food_habits = self.get_foodhabit_by_id(row['food_habit_id']) if row['food_habit_id'] is not '' else None,
+            food_habits = self.__foodhabit_from_id(row['food_habit_id']),
             ok_cats = row['ok_cats'],
             category = row['category']
         )
 
-    def get_all_dogs(self):
+    def get_all_dogs(self, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("animal.id", limit, after_id)
         query = ''' SELECT animal.*, dog.category, dog.ok_cats FROM dog
                     LEFT JOIN animal ON dog.animal_id = animal.id
-                    '''
-        dogs = []
-
+                    ''' + page
         cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
 
-        for row in cursor.execute(query):
-            dog = self.dog_from_row(row)
-            self.__link_animal(dog)
-            dogs.append(dog)
+        # Todo : Build care list
+        return self.__build_animals(rows, "dog_from_row")
 
-            # Todo : Build care list
-        return dogs
+    def iter_all_dogs(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_dogs, chunk_size)
 
     def __get_dog_by_id_simple(self, id):
         query = ''' SELECT animal.*, dog.category, dog.ok_cats FROM dog
@@ -523,10 +1792,15 @@ class SQLiteStorage:
         return self.dog_from_row(row)
 
     def get_dog_by_id(self, id):
+        animal = self.__lookup(Animal, id)
+        if animal is not None:
+            return animal if isinstance(animal, Dog) else None
+
         dog = self.__get_dog_by_id_simple(id)
 
         if dog is not None:
             self.__link_animal(dog)
+            self.__remember(dog)
 
         return dog
 
@@ -542,8 +1816,8 @@ class SQLiteStorage:
             id = row['id'],
             species = row['species_id'],
             name = row['name'],
-            birth_date = date.fromisoformat(row['birth_date']) if row['birth_date'] is not '' else None,
-            arrival_date = date.fromisoformat(row['arrival_date']) if row['arrival_date'] is not '' else None,
+            birth_date = SQLiteStorage.date_from_sql(row['birth_date']),
+            arrival_date = SQLiteStorage.date_from_sql(row['arrival_date']),
             arrival_sheet = None,
             latest_sheet = None,
             gender = row['gender'],
@@ -554,25 +1828,23 @@ class SQLiteStorage:
             implant = row['implant'],
             neutered = row['neutered'],
             history = row['history'],
-            food_habits = self.get_foodhabit_by_id(row['food_habit_id']) if row['food_habit_id'] is not '' else None,
+            food_habits = self.__foodhabit_from_id(row['food_habit_id']),
             has_fiv = row['has_fiv'],
             has_felv = row['has_felv']
         )
 
-    def get_all_cats(self):
+    def get_all_cats(self, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("animal.id", limit, after_id)
         query = ''' SELECT animal.*, cat.has_fiv, cat.has_felv FROM cat
                     LEFT JOIN animal ON cat.animal_id = animal.id
-                '''
-        cats = []
-
+                ''' + page
         cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
 
-        for row in cursor.execute(query):
-            cat = self.cat_from_row(row)
-            self.__link_animal(cat)
-            cats.append(cat)
+        return self.__build_animals(rows, "cat_from_row")
 
-        return cats
+    def iter_all_cats(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_cats, chunk_size)
 
     def __get_cat_by_id_simple(self, id):
         query = ''' SELECT animal.*, cat.has_fiv, cat.has_felv FROM cat
@@ -589,16 +1861,70 @@ class SQLiteStorage:
         return self.cat_from_row(row)
 
     def get_cat_by_id(self, id):
+        animal = self.__lookup(Animal, id)
+        if animal is not None:
+            return animal if isinstance(animal, Cat) else None
+
         cat = self.__get_cat_by_id_simple(id)
 
         if cat is not None:
             self.__link_animal(cat)
+            self.__remember(cat)
 
         return cat
 
     def get_animals_by_box_id(self, box_id):
         return []
 
+    def __get_animal_summaries(self, table, summary_cls, limit, after_id):
+        '''
+        Returns the summaries of the animals of the given species table, built
+        with a single query reading only the columns they need
+        '''
+        extra_fields = summary_cls._fields[len(summary_fields):]
+        [page, values] = SQLiteStorage.forge_query_page("animal.id", limit, after_id)
+        query = ''' SELECT animal.id, animal.name, animal.pictures,
+                    animal.gender, animal.birth_date, animal.arrival_date,
+                    animal.neutered, state.label, location.location_type,
+                    box.label''' + \
+                "".join(", " + table + "." + field for field in extra_fields) + \
+                " FROM " + table + '''
+                    JOIN animal ON ''' + table + '''.animal_id = animal.id
+                    LEFT JOIN sheet ON sheet.id = animal.latest_sheet_id
+                    LEFT JOIN state ON state.id = sheet.state_id
+                    LEFT JOIN location ON location.id = sheet.location_id
+                    LEFT JOIN box ON box.id = location.box_id
+                    ''' + page
+        summaries = []
+
+        cursor = self.con.cursor()
+
+        for row in cursor.execute(query, values):
+            [id, name, pictures, gender, birth_date, arrival_date] = row[:6]
+            summaries.append(summary_cls(
+                id,
+                name,
+                pictures.split(',')[0] if pictures else None,
+                gender,
+                SQLiteStorage.date_from_sql(birth_date),
+                SQLiteStorage.date_from_sql(arrival_date),
+                *row[6:]
+            ))
+
+        return summaries
+
+    def get_dog_summaries(self, limit = None, after_id = None):
+        return self.__get_animal_summaries("dog", DogSummary, limit, after_id)
+
+    def iter_dog_summaries(self, chunk_size = None):
+        return self.__iter_pages(self.get_dog_summaries, chunk_size)
+
+    def get_cat_summaries(self, limit = None, after_id = None):
+        return self.__get_animal_summaries("cat", CatSummary, limit, after_id)
+
+    def iter_cat_summaries(self, chunk_size = None):
+        return self.__iter_pages(self.get_cat_summaries, chunk_size)
+
     @classmethod
     def params_care(cls, care):
         return {
@@ -619,19 +1945,22 @@ class SQLiteStorage:
                 description = row['description']
         )
 
-    def get_all_cares(self):
-        return self.__get_all(Care, "care_from_row")
+    def get_all_cares(self, limit = None, after_id = None):
+        return self.__get_all_references(Care, limit, after_id)
+
+    def iter_all_cares(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_cares, chunk_size)
 
     def get_care_by_id(self, id):
-        return self.__get_by_id(Care, "care_from_row", id)
+        return self.__get_reference_by_id(Care, id)
 
     @classmethod
     def params_caresheet(cls, caresheet):
         return {
                 "animal_id" : caresheet.animal.id if caresheet.animal is not None else -1,
                 "care_id" : caresheet.care.id if caresheet.care is not None else -1,
-                "date" : caresheet.date.isoformat(),
-                "time" : caresheet.time.isoformat(),
+                "date" : SQLiteStorage.date_to_sql(caresheet.date),
+                "time" : SQLiteStorage.date_to_sql(caresheet.time),
                 "frequency" : caresheet.frequency,
                 "given_by" : caresheet.given_by.id if caresheet.given_by is not None else -1,
                 "prescription_number" : caresheet.prescription_number,
@@ -643,29 +1972,75 @@ class SQLiteStorage:
                     id = row['id'],
                     animal = self.get_animal_by_id(row['animal_id']) if row['animal_id'] > 0 else None,
                     care = self.get_care_by_id(row['care_id']) if row['care_id'] > 0 else None,
-                    date = date.fromisoformat(row['date']) if row['date'] is not '' else None,
-                    time = time.fromisoformat(row['time']) if row['time'] is not '' else None,
+                    date = SQLiteStorage.date_from_sql(row['date']),
+                    time = SQLiteStorage.date_from_sql(row['time'], time),
                     frequency = row['frequency'],
-                    given_by = None, #TODO
+                    given_by = self.__person_from_id(row['given_by']),
                     prescription_number = row['prescription_number'],
                     dosage = row['dosage']
                 )
-    def get_all_caresheets(self):
-        return self.__get_all(CareSheet, "caresheet_from_row")
+    def __build_caresheets(self, rows):
+        '''
+        Builds the caresheets described by rows, loading their animals and
+        persons in a fixed number of queries
+        '''
+        caresheets = []
+
+        with self.identity_scope():
+            self.get_animals_by_ids([row['animal_id'] for row in rows
+                                     if row['animal_id'] > 0])
+            self.__prefetch_persons([row['given_by'] for row in rows])
+
+            for row in rows:
+                caresheet = self.__lookup(CareSheet, row['id'])
+                if caresheet is None:
+                    caresheet = self.caresheet_from_row(row)
+                    self.__remember(caresheet)
+
+                caresheets.append(caresheet)
+
+        return caresheets
+
+    def get_all_caresheets(self, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id)
+        query = "SELECT * FROM caresheet " + page
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        return self.__build_caresheets(rows)
+
+    def iter_all_caresheets(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_caresheets, chunk_size)
 
     def get_caresheet_by_id(self, id):
         return self.__get_by_id(CareSheet, "caresheet_from_row", id)
 
-    def get_all_caresheets_by_animal_id(self, animal_id):
-        query = "SELECT * FROM caresheet WHERE animal_id = ?"
-        caresheets = []
+    def get_all_caresheets_by_animal_id(self, animal_id, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id, True)
+        query = "SELECT * FROM caresheet WHERE animal_id = ? " + page
 
         cursor = self.con.cursor()
+        rows = cursor.execute(query, [animal_id] + values).fetchall()
 
-        for row in cursor.execute(query, [animal_id]):
-            caresheets.append(self.caresheet_from_row(row))
+        return self.__build_caresheets(rows)
 
-        return caresheets
+    def get_all_caresheets_by_date(self, start = None, end = None):
+        '''
+        Returns the caresheets due between start and end included, ordered by
+        date and time
+        '''
+        [where, values] = SQLiteStorage.forge_query_date_range("date", start, end)
+        query = "SELECT * FROM caresheet " + where + " ORDER BY date, time, id"
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        return self.__build_caresheets(rows)
+
+    def iter_all_caresheets_by_animal_id(self, animal_id, chunk_size = None):
+        return self.__iter_pages(self.get_all_caresheets_by_animal_id,
+                                 chunk_size, animal_id)
 
     @classmethod
     def params_foodhabit(cls, foodhabit):
@@ -681,8 +2056,11 @@ class SQLiteStorage:
                     bowl = self.get_bowl_by_id(row['bowl_id']) if row['bowl_id'] > 0 else None,
                 )
 
-    def get_all_foodhabits(self):
-        return self.__get_all(FoodHabit, "foodhabit_from_row")
+    def get_all_foodhabits(self, limit = None, after_id = None):
+        return self.__get_all(FoodHabit, "foodhabit_from_row", limit, after_id)
+
+    def iter_all_foodhabits(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_foodhabits, chunk_size)
 
     def get_foodhabit_by_id(self, id):
         return self.__get_by_id(FoodHabit, "foodhabit_from_row", id)
@@ -700,11 +2078,32 @@ class SQLiteStorage:
                     id = row['id'],
                     location_type = row['location_type'],
                     box = self.get_box_by_id(row['box_id']) if row['box_id'] > 0 else None,
-                    person = None
+                    person = self.__person_from_id(row['person_id'])
                 )
 
-    def get_all_locations(self):
-        return self.__get_all(Location, "location_from_row")
+    def get_all_locations(self, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id)
+        query = "SELECT * FROM location " + page
+        locations = []
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        with self.identity_scope():
+            self.__prefetch_persons([row['person_id'] for row in rows])
+
+            for row in rows:
+                location = self.__lookup(Location, row['id'])
+                if location is None:
+                    location = self.location_from_row(row)
+                    self.__remember(location)
+
+                locations.append(location)
+
+        return locations
+
+    def iter_all_locations(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_locations, chunk_size)
 
     def get_location_by_id(self, id):
         return self.__get_by_id(Location, "location_from_row", id)
@@ -712,7 +2111,7 @@ class SQLiteStorage:
     @classmethod
     def params_sheet(cls, sheet):
         return {
-                "date" : sheet.date.isoformat() if sheet.date is not None else None,
+                "date" : SQLiteStorage.date_to_sql(sheet.date),
                 "animal_id" : sheet.animal.id if sheet.animal is not None else -1,
                 "state_id" : sheet.state.id if sheet.state is not None else -1,
                 "location_id" : sheet.location.id if sheet.location is not None else -1
@@ -721,25 +2120,50 @@ class SQLiteStorage:
     def sheet_from_row(self, row):
         return Sheet(
                     id = row['id'],
-                    date = date.fromisoformat(row['date']) if row['date'] is not '' else None,
+                    date = SQLiteStorage.date_from_sql(row['date']),
                     animal = None,
                     state = self.get_state_by_id(row['state_id']) if row['state_id'] > 0 else None,
                     location = self.get_location_by_id(row['location_id']) if row['location_id'] > 0 else None,
                 )
 
-    def get_all_sheets(self):
-        query = "SELECT * FROM sheet"
+    def __build_sheets(self, rows):
+        '''
+        Builds and links the sheets described by rows, loading their locations
+        and animals in a fixed number of queries
+        '''
         sheets = []
 
-        cursor = self.con.cursor()
+        with self.identity_scope():
+            # The animals come with their arrival and latest sheets, which may
+            # be some of these ones
+            self.get_animals_by_ids(set(row['animal_id'] for row in rows
+                                        if row['animal_id'] > 0))
+            self.__prefetch_locations([row['location_id'] for row in rows
+                                       if not self.__is_known(Sheet, row['id'])])
 
-        for row in cursor.execute(query):
-            sheet = self.sheet_from_row(row)
-            self.__link_sheet(sheet)
-            sheets.append(sheet)
+            for row in rows:
+                sheet = self.__lookup(Sheet, row['id'])
+                if sheet is None:
+                    sheet = self.sheet_from_row(row)
+                    sheet.animal = self.__lookup(Animal, row['animal_id'])
+                    self.__remember(sheet)
+
+                sheets.append(sheet)
 
         return sheets
 
+    def get_all_sheets(self, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id)
+        query = "SELECT * FROM sheet " + page
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        return self.__build_sheets(rows)
+
+    def iter_all_sheets(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_sheets, chunk_size)
+
     def __link_sheet(self, sheet):
         query = "SELECT animal_id FROM sheet WHERE id = ?"
 
@@ -747,11 +2171,17 @@ class SQLiteStorage:
         cursor.execute(query, [sheet.id])
         [animal_id] = cursor.fetchone()
 
+        animal = self.__lookup(Animal, animal_id)
+        if animal is not None:
+            sheet.animal = animal
+            return
+
         animal = self.__get_animal_by_id_simple(animal_id)
         sheet.animal = animal
 
         if animal is not None:
             self.__link_animal(animal)
+            self.__remember(animal)
 
     def __get_sheet_by_id_simple(self, id):
         return self.__get_by_id(Sheet, "sheet_from_row", id)
@@ -764,18 +2194,31 @@ class SQLiteStorage:
 
         return sheet
 
-    def get_all_sheets_by_animal_id(self, animal_id):
-        query = "SELECT * FROM sheet where animal_id = ?"
-        sheets = []
+    def get_all_sheets_by_animal_id(self, animal_id, limit = None, after_id = None):
+        [page, values] = SQLiteStorage.forge_query_page("id", limit, after_id, True)
+        query = "SELECT * FROM sheet where animal_id = ? " + page
 
         cursor = self.con.cursor()
+        rows = cursor.execute(query, [animal_id] + values).fetchall()
 
-        for row in cursor.execute(query, [animal_id]):
-            sheet = self.sheet_from_row(row)
-            self.__link_sheet(sheet)
-            sheets.append(sheet)
+        return self.__build_sheets(rows)
 
-        return sheets
+    def get_all_sheets_by_date(self, start = None, end = None):
+        '''
+        Returns the sheets dated between start and end included, ordered by
+        date
+        '''
+        [where, values] = SQLiteStorage.forge_query_date_range("date", start, end)
+        query = "SELECT * FROM sheet " + where + " ORDER BY date, id"
+
+        cursor = self.con.cursor()
+        rows = cursor.execute(query, values).fetchall()
+
+        return self.__build_sheets(rows)
+
+    def iter_all_sheets_by_animal_id(self, animal_id, chunk_size = None):
+        return self.__iter_pages(self.get_all_sheets_by_animal_id,
+                                 chunk_size, animal_id)
 
     @classmethod
     def params_box(cls, box):
@@ -799,23 +2242,160 @@ class SQLiteStorage:
                     particularity = row['particularity'],
                 )
 
-    def get_all_boxes(self):
-        return self.__get_all(Box, "box_from_row")
+    def get_all_boxes(self, limit = None, after_id = None):
+        return self.__get_all_references(Box, limit, after_id)
+
+    def iter_all_boxes(self, chunk_size = None):
+        return self.__iter_pages(self.get_all_boxes, chunk_size)
 
     def get_box_by_id(self, id):
-        return self.__get_by_id(Box, "box_from_row", id)
+        return self.__get_reference_by_id(Box, id)
+
+    def get_box_occupancy(self):
+        '''
+        Returns a list of BoxOccupancy, one for each box ordered by id, counted
+        with a single grouped query
+        '''
+        query = '''
+        SELECT box.id, animal.species_id, COUNT(animal.id) AS occupants
+        FROM box
+        LEFT JOIN location ON location.box_id = box.id
+                              AND location.location_type = ?
+        LEFT JOIN sheet ON sheet.location_id = location.id
+        LEFT JOIN animal ON animal.latest_sheet_id = sheet.id
+        GROUP BY box.id, animal.species_id
+        ORDER BY box.id
+        '''
+        occupancy = []
+
+        cursor = self.con.cursor()
+
+        with self.__read_scope():
+            for row in cursor.execute(query, [LocationType.BOX]):
+                if len(occupancy) == 0 or occupancy[-1].box.id != row['id']:
+                    occupancy.append(BoxOccupancy(self.get_box_by_id(row['id']), {}))
+
+                if row['species_id'] is not None:
+                    occupancy[-1].occupants[Species(row['species_id'])] = row['occupants']
+
+        return occupancy
 
     def get_person_by_id(self, id):
         if self.person_plugin is None:
             return None
 
-        return self.person_plugin.get_person_by_id(id)
+        with self.plugin_lock:
+            return self.person_plugin.get_person_by_id(id)
 
     def get_all_persons(self):
         if self.person_plugin is None:
             return []
 
-        return self.person_plugin.get_all_persons()
+        with self.plugin_lock:
+            return self.person_plugin.get_all_persons()
+
+    def __fetch_persons(self, ids):
+        '''
+        Returns the persons with the given ids, indexed by id, asking the
+        plugin for all of them at once if it implements get_persons_by_ids()
+        '''
+        if self.person_plugin is None or len(ids) == 0:
+            return {}
+
+        with self.plugin_lock:
+            if hasattr(self.person_plugin, "get_persons_by_ids"):
+                persons = self.person_plugin.get_persons_by_ids(list(ids))
+            else:
+                persons = [self.person_plugin.get_person_by_id(id) for id in ids]
+
+        return {person.id : person for person in persons if person is not None}
+
+    def __prefetch_persons(self, ids):
+        '''
+        Loads the persons with the given ids that are not known yet in the
+        current identity scope
+        '''
+        ids = set(id for id in ids if id is not None and id != '' and id > 0)
+        ids = [id for id in ids if not self.__is_known(Person, id)]
+        persons = self.__fetch_persons(ids)
+
+        for id in ids:
+            self.__remember(persons.get(id), Person, id)
+
+    def __person_from_id(self, id):
+        if id is None or id == '' or id <= 0:
+            return None
+
+        if self.__is_known(Person, id):
+            return self.__lookup(Person, id)
+
+        person = self.get_person_by_id(id)
+        self.__remember(person, Person, id)
+
+        return person
+
+    def __get_person_ids_by_type(self, person_type):
+        return [person.id for person in self.get_all_persons()
+                if person.type == person_type]
+
+    def get_all_animals_by_host_type(self, person_type):
+        '''
+        Returns the animals currently hosted by a person of the given type,
+        e.g. by foster families, ordered by id
+        '''
+        table = SQLiteStorage.animal_species_table + '''
+                    JOIN sheet ON sheet.id = animal.latest_sheet_id
+                    JOIN location ON location.id = sheet.location_id'''
+
+        if self.persons_attached:
+            query = "SELECT " + SQLiteStorage.animal_species_columns + \
+                    " FROM " + table + \
+                    " JOIN person ON person.id = location.person_id" \
+                    " WHERE person.type = ? ORDER BY animal.id"
+
+            cursor = self.con.cursor()
+            rows = cursor.execute(query, [person_type]).fetchall()
+        else:
+            rows = self._get_rows_by_ids(table,
+                                         self.__get_person_ids_by_type(person_type),
+                                         SQLiteStorage.animal_species_columns,
+                                         "location.person_id")
+            rows.sort(key = lambda row: row['id'])
+
+        return self.__build_any_animals(rows)
+
+    def get_all_caresheets_by_person_type(self, person_type):
+        '''
+        Returns the caresheets given by a person of the given type, e.g. by
+        vets, ordered by id
+        '''
+        if self.persons_attached:
+            query = '''
+                SELECT caresheet.* FROM caresheet
+                JOIN person ON person.id = caresheet.given_by
+                WHERE person.type = ? ORDER BY caresheet.id
+                '''
+
+            cursor = self.con.cursor()
+            rows = cursor.execute(query, [person_type]).fetchall()
+        else:
+            rows = self._get_rows_by_ids("caresheet",
+                                         self.__get_person_ids_by_type(person_type),
+                                         "*", "given_by")
+            rows.sort(key = lambda row: row['id'])
+
+        return self.__build_caresheets(rows)
+
+    def get_persons_by_ids(self, ids):
+        '''
+        Returns the persons with the given ids, in the same order, leaving out
+        the ids without any person
+        '''
+        with self.identity_scope():
+            self.__prefetch_persons(ids)
+            persons = [self.__lookup(Person, id) for id in ids]
+
+        return [person for person in persons if person is not None]
 
     @classmethod
     def forge_query_insert(cls, table, params):
@@ -842,29 +2422,29 @@ class SQLiteStorage:
         return [query, values]
 
     def add_animal(self, animal):
-        # First insert the generic animal info
-        cursor = self.con.cursor()
+        with self.transaction():
+            # First insert the generic animal info
+            cursor = self.con.cursor()
 
-        animal_params = SQLiteStorage.params_animal(animal)
-        [query, values] = SQLiteStorage.forge_query_insert("animal", animal_params)
+            animal_params = SQLiteStorage.params_animal(animal)
+            [query, values] = SQLiteStorage.forge_query_insert("animal", animal_params)
 
-        cursor.execute(query, values)
-        self.con.commit()
+            cursor.execute(query, values)
 
-        table = SQLiteStorage.tables[type(animal)] if type(animal) in SQLiteStorage.tables else None
+            table = SQLiteStorage.tables[type(animal)] if type(animal) in SQLiteStorage.tables else None
 
-        # If we have some species-specific info, insert them
-        if table is not None:
-            animal_id = self.get_last_inserted_id("animal")
+            # If we have some species-specific info, insert them
+            if table is not None:
+                animal_id = self.get_last_inserted_id("animal")
 
-            species_params = SQLiteStorage.get_query_params(animal)
-            species_params['animal_id'] = animal_id
-            [query, values] = SQLiteStorage.forge_query_insert(table, species_params)
+                species_params = SQLiteStorage.get_query_params(animal)
+                species_params['animal_id'] = animal_id
+                [query, values] = SQLiteStorage.forge_query_insert(table, species_params)
 
-            cursor.execute(query, values)
-            self.con.commit()
+                cursor.execute(query, values)
 
-        animal.id = self.get_last_inserted_id("animal")
+            animal.id = self.get_last_inserted_id("animal")
+            self.__remember(animal)
 
     def update_animal(self, animal):
         # First insert the generic animal info
@@ -886,7 +2466,7 @@ class SQLiteStorage:
 
             cursor.execute(query, values)
 
-        self.con.commit()
+        self.__commit()
 
     @classmethod
     def forge_query_update_with_field(cls, table, params, id, field):
@@ -976,22 +2556,160 @@ class SQLiteStorage:
         #build the query for the insertion
         [query, values] = SQLiteStorage.forge_query_insert(table, params)
 
+        # A new sheet also updates its animal : commit both at once
+        with self.transaction():
+            cursor = self.con.cursor()
+
+            cursor.execute(query, values)
+
+            obj.id = self.get_last_inserted_id(table)
+            self.__remember(obj)
+            self.__reference_written([obj], 1)
+
+            if isinstance(obj, Sheet):
+                self.update_animal_sheet(obj)
+
+    # Order in which add_many() fills the tables, so that the objects
+    # referenced by other ones already have an id when these are inserted
+    insertion_order = [State, Food, Bowl, Care, Box, FoodHabit, Location,
+                       Animal, Sheet, CareSheet]
+
+    def __insert_many(self, table, params_list):
+        '''
+        Inserts all the rows described by params_list with a single
+        executemany() call, and returns the ids given to these rows.
+        '''
+        if len(params_list) == 0:
+            return []
+
+        [query, values] = SQLiteStorage.forge_query_insert(table, params_list[0])
+
         cursor = self.con.cursor()
+        cursor.executemany(query, [list(params.values()) for params in params_list])
 
-        cursor.execute(query, values)
+        # The rows were inserted by a single statement within a write
+        # transaction, so AUTOINCREMENT gave them consecutive ids
+        last_id = self.get_last_inserted_id(table)
 
-        self.con.commit()
+        return range(last_id - len(params_list) + 1, last_id + 1)
+
+    def __add_many_animals(self, animals):
+        ids = self.__insert_many("animal",
+                    [SQLiteStorage.params_animal(animal) for animal in animals])
+
+        species = {}
+        for animal, id in zip(animals, ids):
+            animal.id = id
+            self.__remember(animal)
+
+            if type(animal) in SQLiteStorage.tables:
+                species.setdefault(type(animal), []).append(animal)
+
+        # Then the species-specific info
+        for cls, species_animals in species.items():
+            params_list = []
+            for animal in species_animals:
+                params = SQLiteStorage.get_query_params(animal)
+                params['animal_id'] = animal.id
+                params_list.append(params)
+
+            self.__insert_many(SQLiteStorage.tables[cls], params_list)
+
+    def __update_animals_sheets(self, sheets):
+        '''
+        Bulk equivalent of update_animal_sheet()
+        '''
+        first_sheets = {}
+        latest_sheets = {}
+
+        for sheet in sheets:
+            if sheet.animal is None or sheet.animal.id <= 0:
+                continue
+
+            first_sheets.setdefault(sheet.animal.id, sheet)
+            latest_sheets[sheet.animal.id] = sheet
+
+        updates = []
+        for row in self._get_rows_by_ids("animal", latest_sheets.keys()):
+            arrival_sheet_id = row['arrival_sheet_id']
+            if arrival_sheet_id is None or arrival_sheet_id <= 0:
+                arrival_sheet_id = first_sheets[row['id']].id
+
+            updates.append([arrival_sheet_id, latest_sheets[row['id']].id, row['id']])
+
+            animal = self.__lookup(Animal, row['id'])
+            if animal is not None:
+                if animal.arrival_sheet is None:
+                    animal.arrival_sheet = first_sheets[row['id']]
+                animal.latest_sheet = latest_sheets[row['id']]
+
+        cursor = self.con.cursor()
+        cursor.executemany('''
+            UPDATE animal SET arrival_sheet_id = ?, latest_sheet_id = ?
+            WHERE id = ?
+            ''', updates)
+
+    def add_many(self, objects):
+        '''
+        Adds all the given objects in a single transaction, inserting all the
+        objects of a given table with a single statement. The objects get
+        their id, as with add().
+
+        Objects can reference each other : the tables are filled following
+        insertion_order, so that referenced objects are inserted first.
+        '''
+        groups = {}
+
+        for obj in objects:
+            cls = Animal if isinstance(obj, Animal) else type(obj)
+
+            if cls not in SQLiteStorage.insertion_order:
+                raise ValueError("Can't add objects of type %s" % type(obj).__name__)
+
+            groups.setdefault(cls, []).append(obj)
+
+        with self.transaction():
+            for cls in SQLiteStorage.insertion_order:
+                if cls not in groups:
+                    continue
 
-        obj.id = self.get_last_inserted_id(table)
+                if cls is Animal:
+                    self.__add_many_animals(groups[cls])
+                    continue
 
-        if isinstance(obj, Sheet):
-            self.update_animal_sheet(obj)
+                ids = self.__insert_many(SQLiteStorage.tables[cls],
+                        [SQLiteStorage.get_query_params(obj) for obj in groups[cls]])
+
+                for obj, id in zip(groups[cls], ids):
+                    obj.id = id
+                    self.__remember(obj)
+
+                self.__reference_written(groups[cls], len(groups[cls]))
+
+            if Sheet in groups:
+                self.__update_animals_sheets(groups[Sheet])
 
     def update(self, obj):
 
+        obj = LazyProxy.unwrap(obj)
+
         if obj.id < 1:
             raise ValueError("Can't update an object with id %d" % id)
 
+        try:
+            self.__update(obj)
+        except BaseException:
+            # The object may be the one kept for its id, or in the reference
+            # data, with changes that were never written
+            self.__forget(obj)
+            if type(obj) in SQLiteStorage.reference_tables:
+                self.__reference_data = None
+            raise
+
+        # The updated object is now the reference one for its id
+        self.__remember(obj)
+
+    def __update(self, obj):
         if isinstance(obj, Animal):
             self.update_animal(obj)
             return
@@ -1005,8 +2723,9 @@ class SQLiteStorage:
         cursor = self.con.cursor()
 
         cursor.execute(query, values)
+        self.__reference_written([obj], cursor.rowcount)
 
-        self.con.commit()
+        self.__commit()
 
     def __delete_animal(self, animal):
         table = SQLiteStorage.tables[type(animal)] if type(animal) in SQLiteStorage.tables else None
@@ -1019,13 +2738,17 @@ class SQLiteStorage:
             cursor.execute("DELETE FROM " + table + " WHERE id = ?", [row[0]])
 
         cursor.execute("DELETE FROM animal WHERE id = ?", [animal.id])
-        self.con.commit()
+        self.__commit()
 
     def delete(self, obj):
 
+        obj = LazyProxy.unwrap(obj)
+
         if obj.id < 1:
             raise ValueError("Can't delete an object with id %d", id)
 
+        self.__forget(obj)
+
         if isinstance(obj, Animal):
             self.__delete_animal(obj)
             return
@@ -1036,8 +2759,65 @@ class SQLiteStorage:
 
         cursor = self.con.cursor()
         cursor.execute(query, params)
+        self.__reference_written([obj], cursor.rowcount, deleted = True)
 
-        self.con.commit()
+        self.__commit()
+
+    def __get_config_version(self):
+        cursor = self.con.cursor()
+
+        try:
+            cursor.execute("SELECT version FROM config_version")
+        except sqlite3.OperationalError:
+            # The database is not migrated yet
+            return None
+
+        return cursor.fetchone()[0]
+
+    def __load_config(self, version):
+        cursor = self.con.cursor()
+
+        cursor.execute("SELECT key, value FROM config")
+        self.__config = {row['key'] : row['value'] for row in cursor}
+
+        cursor.execute("SELECT plugin_name, key, value FROM plugin_config")
+        self.__plugin_config = {(row['plugin_name'], row['key']) : row['value']
+                                for row in cursor}
+
+        self.__config_version = version
+
+    def check_config(self):
+        '''
+        Reloads the cached configuration if it was changed by another
+        connection since it was read, with a single query if it was not. Done
+        before each read, or once per transaction() block.
+        '''
+        version = self.__get_config_version()
+
+        if self.__config is None or version is None or \
+           version != self.__config_version:
+            self.__load_config(version)
+
+    def __cached_config(self):
+        if self.__needs_check("config") or self.__config is None:
+            self.check_config()
+
+    def __config_written(self):
+        '''
+        Called after each write to the configuration, before the commit. The
+        write bumped the version by one. If the version moved further, other
+        connections changed the configuration since it was read : the cache
+        misses their changes and is dropped.
+        '''
+        version = self.__get_config_version()
+
+        if self.__config_version is not None and \
+           version == self.__config_version + 1:
+            self.__config_version = version
+        else:
+            self.__config = None
+
+        self.__commit()
 
     def set_config(self, key, value):
         query = '''
@@ -1045,22 +2825,18 @@ class SQLiteStorage:
             ON CONFLICT (key) DO UPDATE SET value = ?
         '''
 
+        self.__cached_config()
+
         cursor = self.con.cursor()
         cursor.execute(query, [key, value, value])
 
-        self.con.commit()
+        self.__config[key] = value
+        self.__config_written()
 
     def get_config(self, key):
-        query = "SELECT value FROM config WHERE key = ?"
-
-        cursor = self.con.cursor()
-        cursor.execute(query, [key])
-
-        row = cursor.fetchone()
-        if row is None:
-            return None
+        self.__cached_config()
 
-        return row['value']
+        return self.__config.get(key)
 
     def set_plugin_config(self, plugin, key, value):
         query = '''
@@ -1068,30 +2844,159 @@ class SQLiteStorage:
             ON CONFLICT (plugin_name, key) DO UPDATE SET value = ?
         '''
 
+        self.__cached_config()
+
         cursor = self.con.cursor()
         cursor.execute(query, [plugin.name, key, value, value])
 
-        self.con.commit()
+        self.__plugin_config[(plugin.name, key)] = value
+        self.__config_written()
 
     def get_plugin_config(self, plugin, key):
-        query = '''
-            SELECT value FROM plugin_config
-            WHERE plugin_name = ? AND key = ?
-        '''
-
-        cursor = self.con.cursor()
-        cursor.execute(query, [plugin.name, key])
-
-        row = cursor.fetchone()
-        if row is None:
-            return None
+        self.__cached_config()
 
-        return row['value']
+        return self.__plugin_config.get((plugin.name, key))
 
     def register_plugin(self, plugin):
         if plugin.type == OssacaPluginType.PERSON and self.person_plugin is None:
             self.person_plugin = plugin
 
+class SQLiteStorageManager:
+    '''
+    Process-wide manager of the SQLiteStorage objects used on a database.
+
+    The plugins are loaded and registered only once, by a storage dedicated to
+    them, and shared with all the other storages. Storages are leased with
+    acquire() and given back with release(), their connection being kept open
+    for the next lease.
+
+    The manager can be used from several threads, each thread leasing its own
+    storage. A storage may be given back and leased again by another thread,
+    but must only be used by one thread during a lease.
+
+    :param db_path: Path to the SQLite database
+    :type db_path: str
+
+    :param pool_size: Maximum number of idle storages kept open
+    :type pool_size: int
+
+    :param identity_map: Wether the leased storages use an identity map. The
+    map is cleared each time a storage is given back.
+    :type identity_map: bool
+
+    :param lazy_loading: Wether the leased storages load the sheets and food
+    habits of the animals only when first accessed
+    :type lazy_loading: bool
+
+    :param max_storages: Maximum number of storages leased at the same time,
+    acquire() waiting for a storage to be given back beyond it. None for no
+    limit.
+    :type max_storages: int
+    '''
+
+    def __init__(self, db_path, pool_size = 4, identity_map = False,
+                 lazy_loading = False, max_storages = None):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.identity_map = identity_map
+        self.lazy_loading = lazy_loading
+        self.max_storages = max_storages
+
+        self.__registry = None
+        self.__idle = []
+
+        # Protects the registry and the idle storages
+        self.__lock = threading.Lock()
+
+        self.__leases = None
+        if max_storages is not None:
+            self.__leases = threading.BoundedSemaphore(max_storages)
+
+    def get_plugin_registry(self):
+        '''
+        Returns the storage owning the plugins, connecting it on first use
+        '''
+        with self.__lock:
+            if self.__registry is None:
+                registry = SQLiteStorage()
+                registry.connect(self.db_path, check_same_thread = False)
+                self.__registry = registry
+
+            return self.__registry
+
+    def acquire(self, timeout = None):
+        '''
+        Leases a storage. If max_storages are already leased, waits at most
+        timeout seconds, or forever if timeout is None, for one of them to be
+        given back, and raises TimeoutError if none was.
+        '''
+        registry = self.get_plugin_registry()
+
+        if self.__leases is not None:
+            if not self.__leases.acquire(timeout = timeout):
+                raise TimeoutError("No storage given back in %s seconds" % timeout)
+
+        try:
+            storage = None
+            with self.__lock:
+                if len(self.__idle) > 0:
+                    storage = self.__idle.pop()
+
+            if storage is not None:
+                # The configuration and reference data may have been changed
+                # by another storage or process
+                storage.check_config()
+                storage.check_reference_data()
+                return storage
+
+            storage = SQLiteStorage(self.identity_map, self.lazy_loading)
+            storage.connect(self.db_path, with_plugins = False,
+                            check_same_thread = False)
+            storage.share_plugins(registry)
+        except:
+            if self.__leases is not None:
+                self.__leases.release()
+            raise
+
+        return storage
+
+    def release(self, storage, exception = None):
+        '''
+        Gives a storage back to the pool. Pending changes are commited, or
+        rolled back if the lease ended with an exception.
+        '''
+        try:
+            if exception is None:
+                storage.con.commit()
+            else:
+                storage.rollback()
+
+            storage.clear_identity_map()
+
+            with self.__lock:
+                if len(self.__idle) < self.pool_size:
+                    self.__idle.append(storage)
+                    storage = None
+
+            if storage is not None:
+                storage.close()
+        finally:
+            if self.__leases is not None:
+                self.__leases.release()
+
+    def close(self):
+        with self.__lock:
+            idle = self.__idle
+            registry = self.__registry
+            self.__idle = []
+            self.__registry = None
+
+        for storage in idle:
+            storage.close()
+
+        if registry is not None:
+            registry.close()
+
 # Test code for ossaca_database
 if __name__ == '__main__':
 
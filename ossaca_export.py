@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''
+Module exporting the registers of the shelter (animals, sheets, caresheets and
+locations) to CSV or JSON Lines.
+
+Rows are read from a cursor and written one at a time, so that the memory used
+does not depend on the size of the register.
+
+Usage : ossaca_export.py [-d database] [-f csv|jsonl] register [output]
+'''
+
+import argparse, csv, io, json, sys
+from ossaca_model import *
+from ossaca_database import *
+
+# Query reading each register, ordered by id
+registers = {
+    "animals" : '''
+        SELECT animal.id, animal.species_id AS species, animal.name,
+               animal.birth_date, animal.arrival_date, animal.gender,
+               animal.breed, animal.color, animal.implant, animal.neutered,
+               dog.ok_cats, dog.category, cat.has_fiv, cat.has_felv,
+               animal.arrival_sheet_id, animal.latest_sheet_id
+        FROM animal
+        LEFT JOIN dog ON dog.animal_id = animal.id
+        LEFT JOIN cat ON cat.animal_id = animal.id
+        ORDER BY animal.id
+        ''',
+
+    "sheets" : '''
+        SELECT sheet.id, sheet.date, sheet.animal_id, animal.name AS animal,
+               animal.implant, state.label AS state,
+               location.location_type, box.label AS box
+        FROM sheet
+        LEFT JOIN animal ON animal.id = sheet.animal_id
+        LEFT JOIN state ON state.id = sheet.state_id
+        LEFT JOIN location ON location.id = sheet.location_id
+        LEFT JOIN box ON box.id = location.box_id
+        ORDER BY sheet.id
+        ''',
+
+    "caresheets" : '''
+        SELECT caresheet.id, caresheet.date, caresheet.time,
+               caresheet.animal_id, animal.name AS animal, animal.implant,
+               care.medecine_name AS care, care.way, caresheet.frequency,
+               caresheet.prescription_number, caresheet.dosage
+        FROM caresheet
+        LEFT JOIN animal ON animal.id = caresheet.animal_id
+        LEFT JOIN care ON care.id = caresheet.care_id
+        ORDER BY caresheet.id
+        ''',
+
+    "locations" : '''
+        SELECT location.id, location.location_type, location.box_id,
+               box.label AS box, location.person_id
+        FROM location
+        LEFT JOIN box ON box.id = location.box_id
+        ORDER BY location.id
+        '''
+}
+
+# Columns holding an enum, exported by name
+enum_columns = {
+    "species" : Species,
+    "gender" : Gender,
+    "location_type" : LocationType
+}
+
+formats = {
+    "csv" : "text/csv",
+    "jsonl" : "application/x-ndjson"
+}
+
+def _enum_name(enum_cls, value):
+    try:
+        return enum_cls(value).name
+    except ValueError:
+        return value
+
+def iter_rows(storage, register):
+    '''
+    Yields the names of the columns of register, then each of its rows as a
+    tuple, read from the database as they are yielded
+    '''
+    if register not in registers:
+        raise ValueError("Unknown register %s" % register)
+
+    cursor = storage.con.cursor()
+    cursor.execute(registers[register])
+
+    columns = [description[0] for description in cursor.description]
+    converters = [enum_columns.get(column) for column in columns]
+    yield columns
+
+    for row in cursor:
+        yield tuple(_enum_name(converter, value) if converter is not None
+                    and value is not None else value
+                    for (converter, value) in zip(converters, row))
+
+def iter_csv(storage, register):
+    '''
+    Yields register as CSV, one line at a time, the first one naming the
+    columns
+    '''
+    line = io.StringIO()
+    writer = csv.writer(line)
+
+    for row in iter_rows(storage, register):
+        writer.writerow(row)
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+def iter_jsonl(storage, register):
+    '''
+    Yields register as JSON Lines, one object per row
+    '''
+    rows = iter_rows(storage, register)
+    columns = next(rows)
+
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii = False) + "\n"
+
+def iter_export(storage, register, format = "csv"):
+    '''
+    Yields register in the given format, one line at a time
+    '''
+    if format == "csv":
+        return iter_csv(storage, register)
+
+    if format == "jsonl":
+        return iter_jsonl(storage, register)
+
+    raise ValueError("Unknown export format %s" % format)
+
+def export(storage, register, out, format = "csv"):
+    '''
+    Writes register in the given format to the file object out
+    '''
+    for line in iter_export(storage, register, format):
+        out.write(line)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Exports a register of the shelter")
+    parser.add_argument("register", choices = sorted(registers))
+    parser.add_argument("output", nargs = "?", help = "Output file, stdout by default")
+    parser.add_argument("-d", "--database", default = "ossaca_db.sqlite")
+    parser.add_argument("-f", "--format", choices = sorted(formats), default = "csv")
+    args = parser.parse_args()
+
+    s = SQLiteStorage()
+    s.connect(args.database, with_plugins = False)
+
+    if args.output is None:
+        export(s, args.register, sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline = "", encoding = "utf-8") as out:
+            export(s, args.register, out, args.format)
+
+    s.close()
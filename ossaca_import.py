@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''
+Module importing animals, along with their arrival in the shelter, from CSV
+files.
+
+The file is read one row at a time and the animals are written by batches,
+each one in a single transaction with SQLiteStorage.add_many().
+
+Usage : ossaca_import.py [-d database] [-b batch size] file
+'''
+
+import argparse, csv, sqlite3, sys
+from collections import namedtuple
+from ossaca_model import *
+from ossaca_database import *
+
+# Result of an import : the number of animals imported, and the list of the
+# rejected rows as (line number, reason) pairs
+ImportReport = namedtuple("ImportReport", ["imported", "rejected"])
+
+class AnimalImporter:
+    '''
+    Imports animals from CSV files into a storage.
+
+    The first line of a file names its columns, among name, species,
+    birth_date, arrival_date, gender, breed, color, character, history,
+    implant, neutered, ok_cats, category, has_fiv, has_felv, state and box.
+    Only name is mandatory. Enums are given by name or value, dates in ISO
+    8601 and booleans as 0/1, yes/no, true/false or oui/non.
+
+    An animal with a state or a box gets an arrival sheet, dated from its
+    arrival. States and boxes are looked up by label, and created if missing
+    when create_missing is True. Breeds are written with the spelling already
+    used in the database, whatever their case.
+
+    If a batch can't be written, e.g. because another connection used one of
+    its implants meanwhile, all its rows are rejected and the following
+    batches are still imported.
+
+    :param storage: The storage to import into
+    :type storage: SQLiteStorage
+
+    :param batch_size: Number of rows written in each transaction
+    :type batch_size: int
+
+    :param create_missing: Wether unknown states and boxes are created
+    :type create_missing: bool
+
+    :param progress: Function called after each batch with the number of rows
+    imported and rejected so far
+    :type progress: function
+    '''
+
+    booleans = {
+        "" : False, "0" : False, "no" : False, "false" : False, "non" : False,
+        "1" : True, "yes" : True, "true" : True, "oui" : True
+    }
+
+    def __init__(self, storage, batch_size = 1000, create_missing = True,
+                 progress = None):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.create_missing = create_missing
+        self.progress = progress
+
+        # Lookups, filled on first import
+        self.__states = None
+        self.__boxes = None
+        self.__locations = {}
+        self.__breeds = None
+        self.__implants = None
+
+    @classmethod
+    def lookup_key(cls, label):
+        '''
+        Returns the key a state, box or breed label is looked up with
+        '''
+        return label.strip().lower()
+
+    def __load_lookups(self):
+        if self.__states is not None:
+            return
+
+        self.__states = {AnimalImporter.lookup_key(state.label) : state
+                         for state in self.storage.get_all_states()}
+        self.__boxes = {AnimalImporter.lookup_key(box.label) : box
+                        for box in self.storage.get_all_boxes()}
+
+        self.__load_animal_lookups()
+
+    def __load_animal_lookups(self):
+        cursor = self.storage.con.cursor()
+        cursor.execute("SELECT DISTINCT breed FROM animal WHERE breed != ''")
+        self.__breeds = {AnimalImporter.lookup_key(row[0]) : row[0]
+                         for row in cursor}
+
+        cursor.execute("SELECT implant FROM animal WHERE implant != ''")
+        self.__implants = set(row[0] for row in cursor)
+
+    def __forget_batch(self, batch):
+        '''
+        Drops from the lookups what was added to them by the rows of a batch
+        that could not be written
+        '''
+        batch = set(batch)
+
+        self.__states = {key : state for (key, state) in self.__states.items()
+                         if state not in batch}
+        self.__boxes = {key : box for (key, box) in self.__boxes.items()
+                        if box not in batch}
+        self.__locations = {box : location for (box, location)
+                            in self.__locations.items() if location not in batch}
+
+        # The breeds and implants written are those of the database
+        self.__load_animal_lookups()
+
+    @classmethod
+    def parse_enum(cls, enum_cls, value, default):
+        value = value.strip()
+
+        if value == "":
+            return default
+
+        if value.lstrip("-").isdigit():
+            return enum_cls(int(value))
+
+        try:
+            return enum_cls[value.upper()]
+        except KeyError:
+            raise ValueError("invalid %s %s" % (enum_cls.__name__, value))
+
+    @classmethod
+    def parse_bool(cls, value):
+        try:
+            return AnimalImporter.booleans[value.strip().lower()]
+        except KeyError:
+            raise ValueError("invalid boolean %s" % value)
+
+    @classmethod
+    def parse_date(cls, value):
+        value = value.strip()
+        return date.fromisoformat(value) if value != "" else None
+
+    def __check_lookup(self, lookup, cls, label):
+        if label != "" and not self.create_missing and \
+           AnimalImporter.lookup_key(label) not in lookup:
+            raise ValueError("unknown %s %s" % (cls.__name__.lower(), label))
+
+    def __lookup(self, lookup, cls, label, new_objects):
+        key = AnimalImporter.lookup_key(label)
+
+        if key not in lookup:
+            lookup[key] = cls(label = label)
+            new_objects.append(lookup[key])
+
+        return lookup[key]
+
+    def __location(self, box, new_objects):
+        if box not in self.__locations:
+            self.__locations[box] = Location(location_type = LocationType.BOX,
+                                             box = box)
+            new_objects.append(self.__locations[box])
+
+        return self.__locations[box]
+
+    def parse_row(self, row):
+        '''
+        Returns the objects to add for a row of the file, the animal being the
+        first one. Raises ValueError if the row is invalid.
+        '''
+        row = {key.strip().lower() : (value or "") for (key, value) in row.items()
+               if key is not None}
+        objects = []
+
+        name = row.get("name", "").strip()
+        if name == "":
+            raise ValueError("missing name")
+
+        species = AnimalImporter.parse_enum(Species, row.get("species", ""),
+                                            Species.UNKNOWN)
+        if species == Species.DOG:
+            animal = Dog(
+                ok_cats = AnimalImporter.parse_enum(CatCompatibility,
+                            row.get("ok_cats", ""), CatCompatibility.UNKNOWN),
+                category = int(row.get("category") or 0))
+        elif species == Species.CAT:
+            animal = Cat(
+                has_fiv = AnimalImporter.parse_bool(row.get("has_fiv", "")),
+                has_felv = AnimalImporter.parse_bool(row.get("has_felv", "")))
+        else:
+            animal = Animal(species = species)
+
+        animal.name = name
+        animal.birth_date = AnimalImporter.parse_date(row.get("birth_date", ""))
+        animal.arrival_date = AnimalImporter.parse_date(row.get("arrival_date", "")) \
+                              or date.today()
+        animal.gender = AnimalImporter.parse_enum(Gender, row.get("gender", ""),
+                                                  Gender.UNKNOWN)
+        animal.color = row.get("color", "").strip()
+        animal.character = row.get("character", "")
+        animal.history = row.get("history", "")
+        animal.neutered = AnimalImporter.parse_bool(row.get("neutered", ""))
+        animal.pictures = []
+
+        animal.implant = row.get("implant", "").strip()
+        if animal.implant != "":
+            if animal.implant in self.__implants:
+                raise ValueError("implant %s already used" % animal.implant)
+
+        state_label = row.get("state", "").strip()
+        box_label = row.get("box", "").strip()
+        self.__check_lookup(self.__states, State, state_label)
+        self.__check_lookup(self.__boxes, Box, box_label)
+
+        # The row is valid from here
+        objects.append(animal)
+
+        breed = row.get("breed", "").strip()
+        animal.breed = self.__breeds.setdefault(AnimalImporter.lookup_key(breed),
+                                                breed)
+
+        state = None
+        if state_label != "":
+            state = self.__lookup(self.__states, State, state_label, objects)
+
+        location = None
+        if box_label != "":
+            box = self.__lookup(self.__boxes, Box, box_label, objects)
+            location = self.__location(box, objects)
+
+        if state is not None or location is not None:
+            objects.append(Sheet(date = animal.arrival_date, animal = animal,
+                                 state = state, location = location))
+
+        if animal.implant != "":
+            self.__implants.add(animal.implant)
+
+        return objects
+
+    def __write(self, batch, lines, rejected):
+        '''
+        Writes the objects of a batch, read from the given lines. Returns the
+        number of rows imported. If the batch can't be written, e.g. because
+        another connection used one of its implants meanwhile, its lines are
+        rejected and nothing of it is kept.
+        '''
+        try:
+            self.storage.add_many(batch)
+        except sqlite3.Error as e:
+            self.__forget_batch(batch)
+            rejected.extend((line, "not written : %s" % e) for line in lines)
+            return 0
+
+        return len(lines)
+
+    def import_csv(self, f):
+        '''
+        Imports the animals of the CSV file object f, returns an ImportReport
+        '''
+        self.__load_lookups()
+
+        reader = csv.DictReader(f)
+        batch = []
+        lines = []
+        imported = 0
+        rejected = []
+
+        for row in reader:
+            try:
+                batch.extend(self.parse_row(row))
+                lines.append(reader.line_num)
+            except (ValueError, TypeError) as e:
+                rejected.append((reader.line_num, str(e)))
+
+            if len(lines) == self.batch_size:
+                imported += self.__write(batch, lines, rejected)
+                batch = []
+                lines = []
+
+                if self.progress is not None:
+                    self.progress(imported, len(rejected))
+
+        if len(lines) > 0:
+            imported += self.__write(batch, lines, rejected)
+
+        if self.progress is not None:
+            self.progress(imported, len(rejected))
+
+        rejected.sort(key = lambda line_reason: line_reason[0])
+
+        return ImportReport(imported, rejected)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Imports animals from a CSV file")
+    parser.add_argument("file")
+    parser.add_argument("-d", "--database", default = "ossaca_db.sqlite")
+    parser.add_argument("-b", "--batch-size", type = int, default = 1000)
+    args = parser.parse_args()
+
+    def progress(imported, rejected):
+        print("%d imported, %d rejected" % (imported, rejected), file = sys.stderr)
+
+    s = SQLiteStorage()
+    s.connect(args.database, with_plugins = False)
+
+    importer = AnimalImporter(s, args.batch_size, progress = progress)
+
+    with open(args.file, newline = "", encoding = "utf-8") as f:
+        report = importer.import_csv(f)
+
+    s.close()
+
+    for (line, reason) in report.rejected:
+        print("line %d : %s" % (line, reason), file = sys.stderr)
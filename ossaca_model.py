@@ -36,7 +36,29 @@ class CatCompatibility(IntEnum):
     YES = 1
     UNKNOWN = 2
 
-class Type:
+class Model:
+    '''
+    Base class of the model classes. They keep their attributes in __slots__,
+    which are gathered in a dict as the state of an object, so that it can be
+    pickled with any protocol and copied.
+    '''
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+class Type(Model):
     '''
     Generic class describing an eumerable entity with a label, a description and
     an id
@@ -50,6 +72,8 @@ class Type:
     :param description: Text describing the state
     :type description: str
     '''
+    __slots__ = ("id", "label", "description")
+
     def __init__(self, id = -1, label = "", description = ""):
         self.id = id
         self.label = label
@@ -59,10 +83,12 @@ class State(Type):
     '''
     Class describing an animal state
     '''
+    __slots__ = ()
+
     def __init__(self, id = -1, label = "", description = ""):
         Type.__init__(self, id, label, description)
 
-class Animal:
+class Animal(Model):
     '''
     Class representing a generic animal.
 
@@ -118,6 +144,11 @@ class Animal:
     :param food_habits: Indicates how the animal is used to being feed
     :type food_habits: FoodHabit
     '''
+    __slots__ = ("id", "name", "species", "birth_date", "arrival_date",
+                 "arrival_sheet", "latest_sheet", "gender", "breed",
+                 "character", "color", "pictures", "sponsors", "implant",
+                 "neutered", "history", "food_habits")
+
     def __init__(self, id = -1, species = Species.UNKNOWN, name = "",
                  birth_date = None, arrival_date = None,
                  arrival_sheet = None, latest_sheet = None,
@@ -161,6 +192,8 @@ class Dog(Animal):
     :param ok_cats: Indicated if this dog can live with cats
     :type ok_cats: CatCompatibility
     '''
+    __slots__ = ("ok_cats", "category")
+
     def __init__(self, id = -1, species = Species.DOG, name = "",
                  birth_date = None, arrival_date = None,
                  arrival_sheet = None, latest_sheet = None,
@@ -188,6 +221,8 @@ class Cat(Animal):
     :type has_felv: bool
 
     '''
+    __slots__ = ("has_fiv", "has_felv")
+
     def __init__(self, id = -1, species = Species.CAT, name = "",
                  birth_date = None, arrival_date = None,
                  arrival_sheet = None, latest_sheet = None,
@@ -202,7 +237,7 @@ class Cat(Animal):
         self.has_fiv = has_fiv
         self.has_felv = has_felv
 
-class Care:
+class Care(Model):
     '''
     A Class representing a care that can be given to an animal
 
@@ -224,6 +259,8 @@ class Care:
     :param description: Description of the medecine
     :type description: str
     '''
+    __slots__ = ("id", "type", "dose", "way", "medecine_name", "description")
+
     def __init__(self, id = -1, type = "", dose = "", way = "",
                  medecine_name = "", description = ""):
         self.id = id
@@ -233,7 +270,7 @@ class Care:
         self.medecine_name = medecine_name
         self.description = description
 
-class CareSheet:
+class CareSheet(Model):
     '''
     A Care Sheet describes a care given to a particular animal at a given date,
     to treat a given Disease.
@@ -273,6 +310,10 @@ class CareSheet:
     :param dosage: Dose admistrated to the animal
     :type dosage: str
     '''
+    __slots__ = ("id", "animal", "care", "disease", "date", "time",
+                 "frequency", "duration", "given_by", "prescription_number",
+                 "dosage")
+
     def __init__(self, id = -1, animal = None, care = None, disease = None,
                  date = None, time = None, frequency = "", duration = 0,
                  given_by = None, prescription_number = "", dosage = ""):
@@ -299,10 +340,12 @@ class Disease(Type):
     :param description: A description for the disease
     :type description: str
     '''
+    __slots__ = ()
+
     def __init__(self, id = -1, label = "", description = ""):
         Type.__init__(self, id, label, description)
 
-class FoodHabit:
+class FoodHabit(Model):
     '''
     Class describing a feeding habit for an animal, such as what type of food
     and what quantities
@@ -316,6 +359,8 @@ class FoodHabit:
     :param bowl: The way to give the food, in terms of quantities
     :type bowl: Bowl
     '''
+    __slots__ = ("id", "food", "bowl")
+
     def __init__(self, id = -1, food = None, bowl = None):
         self.id = id
         self.food = food
@@ -325,6 +370,8 @@ class Bowl(Type):
     '''
     Class representing a way to give food
     '''
+    __slots__ = ()
+
     def __init__(self, id = -1, label = "", description = ""):
         Type.__init__(self, id, label, description)
 
@@ -332,6 +379,8 @@ class Food(Type):
     '''
     A food type to give to an animal
     '''
+    __slots__ = ()
+
     def __init__(self, id = -1, label = "", description = ""):
         Type.__init__(self, id, label, description)
 
@@ -345,7 +394,7 @@ class LocationType(IntEnum):
     FOSTER_FAMILY = 2
     OTHER = 3
 
-class Location:
+class Location(Model):
 
     '''
     Describes the location of an animal. Depending on the location_type, the
@@ -365,6 +414,8 @@ class Location:
     location_type is VET or FOSTER_FAMILY.
     :type person: Person
     '''
+    __slots__ = ("id", "location_type", "box", "person")
+
     def __init__(self, id = -1, location_type = LocationType.OTHER, box = None,
                  person = None):
         self.id = id
@@ -372,7 +423,7 @@ class Location:
         self.box = box
         self.person = person
 
-class Sheet:
+class Sheet(Model):
     '''
     A Sheet describes a state or location change for the animal.
 
@@ -391,6 +442,8 @@ class Sheet:
     :param location: The location of the animal
     :type location: Location
     '''
+    __slots__ = ("id", "date", "animal", "state", "location")
+
     def __init__(self, id = -1, date = None, animal = None, state = None,
                  location = None):
         self.id = id
@@ -399,7 +452,7 @@ class Sheet:
         self.state = state
         self.location = location
 
-class Box:
+class Box(Model):
     '''
     :param id: A unique identifier for this box
     :type id: int
@@ -422,6 +475,9 @@ class Box:
     :param particularity: Any specific feature of this box
     :type particularity: str
     '''
+    __slots__ = ("id", "label", "description", "surface_area", "position",
+                 "condition", "particularity")
+
     def __init__(self, id = -1, label = "", description = "", surface_area = 0,
                  position = "", condition = "", particularity = ""):
         self.id = id
@@ -447,11 +503,13 @@ class Box:
         else:
             return -1
 
-class Address:
+class Address(Model):
     '''
     Class representing a postal address
     '''
 
+    __slots__ = ("street", "postcode", "city", "country")
+
     def __init__(self, street = "", postcode = "", city = "", country = ""):
         self.street = street
         self.postcode = postcode
@@ -469,12 +527,14 @@ class PersonType:
     ADOPTER = 4
     VET = 5
 
-class Person:
+class Person(Model):
     '''
     Class representing a person. This can be a adopter, a foster family, a vet
     and so on.
     '''
 
+    __slots__ = ("id", "name", "email", "address", "phone", "type")
+
     def __init__(self, id = -1, name = "", email = "", address = Address(),
                  phone = "", type = PersonType.OTHER):
         self.id = id
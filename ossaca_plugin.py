@@ -85,6 +85,11 @@ class OssacaPersonProviderPlugin(OssacaPlugin):
     This plugin must give access to the following methods :
      - .get_all_persons()
      - .get_person_by_id(id)
+
+    It may also give access to .get_persons_by_ids(ids), returning the list
+    of the persons with the given ids in any order, leaving out the ids
+    without any person. The storage then uses it to load all the persons of a
+    result set at once, instead of calling .get_person_by_id(id) for each one.
     '''
 
     def __init__(self, name = ""):
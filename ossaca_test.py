@@ -1,12 +1,22 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import copy
+import csv
+import io
+import json
+import pickle
 import sqlite3
+import sys
+import tempfile
+import threading
 import unittest
 import os
 import os.path
 from ossaca_model import *
 from ossaca_database import *
+import ossaca_export
+from ossaca_import import *
 from unittest.mock import patch
 
 ########################### DB handling ########################################
@@ -171,6 +181,646 @@ class TestOssacaDB(unittest.TestCase):
 
         s.close()
 
+    def test_identity_map_coherence(self):
+        s = SQLiteStorage(identity_map = True)
+        s.connect("test.db")
+
+        state = State(label = "Arrivé")
+        s.add(state)
+        self.assertIs(s.get_state_by_id(state.id), state)
+
+        new_state = State(id = state.id, label = "Adopté")
+        s.update(new_state)
+        self.assertIs(s.get_state_by_id(state.id), new_state)
+
+        s.delete(new_state)
+        self.assertIsNone(s.get_state_by_id(state.id))
+
+        dog = Dog(name = "Ichi")
+        s.add(dog)
+        self.assertIs(s.get_dog_by_id(dog.id), dog)
+
+        s.close()
+
+    def test_identity_map_failed_update(self):
+        s = SQLiteStorage(identity_map = True)
+        s.connect("test.db")
+
+        s.add(Dog(name = "Ichi", implant = "250269604"))
+        dog = Dog(name = "Louloute", implant = "250269605")
+        s.add(dog)
+
+        # A failed write doesn't leave its changes in the identity map
+        dog.implant = "250269604"
+        with self.assertRaises(sqlite3.IntegrityError):
+            s.update(dog)
+
+        found = s.get_dog_by_id(dog.id)
+        self.assertIsNot(found, dog)
+        self.assertEqual(found.implant, "250269605")
+
+        s.close()
+
+    def count_commits(self, s, func, *args):
+        queries = []
+        s.con.set_trace_callback(queries.append)
+        func(*args)
+        s.con.set_trace_callback(None)
+
+        return len([q for q in queries if q == "COMMIT"])
+
+    def test_add_sheet_single_commit(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        cat = Cat()
+        self.assertEqual(self.count_commits(s, s.add, cat), 1)
+        self.assertEqual(self.count_commits(s, s.add, Sheet(animal = cat)), 1)
+
+        s.close()
+
+    def test_transaction(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        def add_states():
+            with s.transaction():
+                for i in range(10):
+                    s.add(State(label = str(i)))
+
+        self.assertEqual(self.count_commits(s, add_states), 1)
+        s.close()
+
+        self.check_number_of_rows("state", 10)
+
+    def test_transaction_rollback(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        with self.assertRaises(ValueError):
+            with s.transaction():
+                s.add(State(label = "Arrivé"))
+                with s.transaction():
+                    s.add(Dog(name = "Ichi"))
+                raise ValueError()
+
+        s.add(State(label = "Adopté"))
+        s.close()
+
+        self.check_number_of_rows("state", 1)
+        self.check_number_of_rows("dog", 0)
+        self.check_number_of_rows("animal", 0)
+
+    def test_add_many(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        s.add(Dog(name = "Ichi"))
+
+        state = State(label = "Arrivé")
+        dog = Dog(name = "Louloute")
+        cat = Cat(name = "Minette")
+        nac = Animal(species = Species.NAC, name = "hebi")
+        sheets = [Sheet(animal = dog, state = state), Sheet(animal = cat),
+                  Sheet(animal = dog)]
+
+        # Referenced objects are inserted first, whatever the list order
+        objects = sheets + [dog, cat, nac, state]
+        self.assertEqual(self.count_commits(s, s.add_many, objects), 1)
+
+        self.assertEqual([dog.id, cat.id, nac.id, state.id], [2, 3, 4, 1])
+        self.assertEqual([sheet.id for sheet in sheets], [1, 2, 3])
+
+        s.close()
+
+        self.check_number_of_rows("animal", 4)
+        self.check_table_row("dog", 2, [2, 2, CatCompatibility.UNKNOWN, 0])
+        self.check_table_row("cat", 1, [1, 3, 0, 0])
+        self.check_table_row("sheet", 1, [1, date.today().isoformat(), 2, 1, -1])
+        self.check_table_row("animal", 2,
+        [2, Species.DOG, "Louloute", date.today().isoformat(), date.today().isoformat(),
+         1, 3, 0, "", "", "", "", "", 0, "", -1])
+        self.check_table_row("animal", 3,
+        [3, Species.CAT, "Minette", date.today().isoformat(), date.today().isoformat(),
+         2, 2, 0, "", "", "", "", "", 0, "", -1])
+
+    def test_add_many_invalid(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        with self.assertRaises(ValueError):
+            s.add_many([State(), Disease()])
+
+        s.close()
+
+        self.check_number_of_rows("state", 0)
+
+    def get_indexes(self):
+        con = sqlite3.connect("test.db")
+        cursor = con.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        indexes = [row[0] for row in cursor.fetchall()]
+        con.close()
+
+        return indexes
+
+    def test_search_index_sync(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        dog = Dog(name = "Ichi", breed = "Malinois")
+        s.add(dog)
+        s.add_many([Cat(name = "Minette", color = "Tigré")])
+        self.assertEqual([a.name for a in s.search_animals("malin")], ["Ichi"])
+        self.assertEqual([a.name for a in s.search_animals("tigre")], ["Minette"])
+
+        dog.name = "Pato"
+        s.update(dog)
+        self.assertEqual(s.search_animals("ichi"), [])
+        self.assertEqual([a.name for a in s.search_animals("pato")], ["Pato"])
+
+        s.delete(dog)
+        self.assertEqual(s.search_animals("malinois"), [])
+
+        s.close()
+
+    def test_stray_species_row(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        dog = Dog(name = "Ichi", category = 1)
+        s.add(dog)
+
+        # Rows left over in the dog and cat tables don't return it twice, and
+        # its first dog row is the one read
+        s.con.execute("INSERT INTO dog (animal_id, category, ok_cats) VALUES (?, 2, 0)",
+                      [dog.id])
+        s.con.execute("INSERT INTO cat (animal_id, has_fiv, has_felv) VALUES (?, 0, 0)",
+                      [dog.id])
+        s.con.commit()
+
+        for animals in [s.search_animals("ichi"), s.get_all_animals(),
+                        s.get_animals_by_ids([dog.id])]:
+            self.assertEqual([type(a) for a in animals], [Dog])
+            self.assertEqual(animals[0].category, 1)
+
+        s.close()
+
+    def test_unique_implant(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+
+        s.add(Dog(name = "Ichi", implant = "250269604"))
+        with self.assertRaises(sqlite3.IntegrityError):
+            s.add(Dog(name = "Twin", implant = "250269604"))
+
+        # Animals without microchip don't collide
+        s.add(Cat(name = "Minette", implant = ""))
+        s.add(Cat(name = "Minou", implant = ""))
+
+        s.close()
+
+    def test_duplicate_implants_migration(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        s.close()
+
+        # A database holding duplicates before the implants became unique
+        con = sqlite3.connect("test.db")
+        con.execute("DROP INDEX animal_implant")
+        for name in ["Ichi", "Twin", "Minou"]:
+            con.execute("INSERT INTO animal (name, implant) VALUES (?, ?)",
+                        [name, "250269604" if name != "Minou" else ""])
+        con.execute("PRAGMA user_version = 2")
+        con.commit()
+        con.close()
+
+        s = SQLiteStorage()
+        with self.assertLogs(level = "WARNING"):
+            s.connect("test.db")
+        self.assertEqual(s.get_schema_version(), len(SQLiteStorage.migrations))
+        self.assertEqual(s.get_duplicate_implants(), {"250269604" : [1, 2]})
+
+        # The index is a plain one until the duplicates are fixed
+        self.assertIn("animal_implant", self.get_indexes())
+        self.assertEqual(s.enforce_unique_implants(), {"250269604" : [1, 2]})
+
+        s.con.execute("UPDATE animal SET implant = '250269605' WHERE id = 2")
+        s.con.commit()
+        self.assertEqual(s.enforce_unique_implants(), {})
+        with self.assertRaises(sqlite3.IntegrityError):
+            s.add(Dog(name = "Ichi bis", implant = "250269604"))
+
+        s.close()
+
+    def test_empty_dates_migration(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        s.add(Dog(name = "Ichi"))
+        s.add(Sheet(animal = Dog(id = 1)))
+        s.close()
+
+        # Dates used to be stored as '' when missing
+        con = sqlite3.connect("test.db")
+        con.execute("UPDATE animal SET birth_date = ''")
+        con.execute("UPDATE sheet SET date = ''")
+        con.execute("PRAGMA user_version = 3")
+        con.commit()
+        con.close()
+
+        s = SQLiteStorage()
+        s.connect("test.db")
+        self.assertIsNotNone(s.get_dog_by_id(1))
+        self.assertIsNotNone(s.get_sheet_by_id(1))
+        s.close()
+
+        self.check_table_row("animal", 1, [1, Species.DOG, "Ichi", None,
+            date.today().isoformat(), 1, 1, 0, "", "", "", "", "", 0, "", -1])
+        self.check_table_row("sheet", 1, [1, None, 1, -1, -1])
+
+    def test_import_csv(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        s.add(Box(label = "Box 1", surface_area = 10))
+        s.add(Dog(name = "Ichi", breed = "Malinois", implant = "250269604"))
+
+        f = io.StringIO(
+            "name,species,birth_date,arrival_date,gender,breed,implant,neutered,state,box\n"
+            "Louloute,DOG,2015-04-03,2020-02-02,FEMALE,malinois,,oui,Arrivé,box 1\n"
+            "Minette,2,,2020-02-03,1,Angora,1234,0,,Chatterie\n"
+            "Hebi,NAC,,,,,,,,\n"
+            ",DOG,,,,,,,,\n"
+            "Pato,BIRD,,,,,,,,\n"
+            "Joy,CAT,2015-13-01,,,,,,,\n"
+            "Rex,DOG,,,,,250269604,,,\n"
+            "Roger,DOG,,,,,,peut-être,,\n"
+            "Rox,DOG,,,,BEAUCERON,250269604,,,\n"
+            "Bella,DOG,,,,beauceron,,,,\n")
+
+        progress = []
+        importer = AnimalImporter(s, batch_size = 2,
+                    progress = lambda imported, rejected: progress.append(imported))
+        report = importer.import_csv(f)
+
+        self.assertEqual(report.imported, 4)
+        self.assertEqual([line for (line, reason) in report.rejected], [5, 6, 7, 8, 9, 10])
+        self.assertEqual(progress, [2, 4, 4])
+
+        dog = s.get_animal_by_id(2)
+        self.assertIs(type(dog), Dog)
+        self.assertEqual(dog.breed, "Malinois")
+        self.assertEqual(dog.gender, Gender.FEMALE)
+        self.assertTrue(dog.neutered)
+        self.assertEqual(dog.latest_sheet.date, date.fromisoformat("2020-02-02"))
+        self.assertEqual(dog.latest_sheet.state.label, "Arrivé")
+        self.assertEqual(dog.latest_sheet.location.box.id, 1)
+
+        cat = s.get_animal_by_id(3)
+        self.assertIs(type(cat), Cat)
+        self.assertEqual(cat.latest_sheet.location.box.label, "Chatterie")
+        self.assertIsNone(cat.latest_sheet.state)
+
+        self.assertIsNone(s.get_animal_by_id(4).latest_sheet)
+
+        # Rejected rows don't set the spelling of the breeds
+        self.assertEqual(s.get_animal_by_id(5).breed, "beauceron")
+        self.assertEqual(len(s.get_all_boxes()), 2)
+
+        importer = AnimalImporter(s, create_missing = False)
+        report = importer.import_csv(io.StringIO("name,state\nJoy,Adopté\n"))
+        self.assertEqual(report.imported, 0)
+        self.assertEqual(len(s.get_all_states()), 1)
+
+        # Labels are matched whatever their surrounding spaces
+        report = importer.import_csv(io.StringIO("name,state\nJoy, arrivé \n"))
+        self.assertEqual(report.imported, 1)
+
+        s.close()
+
+    def test_import_csv_failed_batch(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        other = SQLiteStorage()
+        other.connect("test.db")
+
+        def progress(imported, rejected):
+            # Another connection takes the implant of the next batch
+            if imported == 1 and rejected == 0:
+                other.add(Dog(name = "Rex", implant = "1234"))
+
+        f = io.StringIO(
+            "name,implant,breed,state,box\n"
+            "Ichi,,Malinois,Arrivé,Box 1\n"
+            "Minette,1234,Angora,Réservé,Box 2\n"
+            "Louloute,,angora, réservé ,box 2\n")
+
+        importer = AnimalImporter(s, batch_size = 1, progress = progress)
+        report = importer.import_csv(f)
+
+        self.assertEqual(report.imported, 2)
+        self.assertEqual([line for (line, reason) in report.rejected], [3])
+        self.assertIn("UNIQUE", report.rejected[0][1])
+
+        # Nothing of the failed batch was kept, even in the lookups
+        self.assertEqual(sorted(a.name for a in s.get_all_animals()),
+                         ["Ichi", "Louloute", "Rex"])
+        louloute = s.search_animals("louloute")[0]
+        self.assertEqual(louloute.breed, "angora")
+        self.assertEqual(louloute.latest_sheet.state.label, "réservé")
+        self.assertEqual(louloute.latest_sheet.location.box.label, "box 2")
+        self.assertEqual(len(s.get_all_states()), 2)
+        self.assertEqual(len(s.get_all_boxes()), 2)
+        self.check_number_of_rows("location", 2)
+
+        other.close()
+        s.close()
+
+    def test_person_resolution(self):
+        persons = {id : Person(id = id, name = "Person %d" % id) for id in [1, 2]}
+        calls = []
+
+        class PerIdPlugin:
+            def get_person_by_id(self, id):
+                calls.append(id)
+                return persons.get(id)
+
+        class BatchPlugin(PerIdPlugin):
+            def get_persons_by_ids(self, ids):
+                calls.append(sorted(ids))
+                return [persons[id] for id in ids if id in persons]
+
+        s = SQLiteStorage()
+        s.connect("test.db", with_plugins = False)
+
+        dog = Dog(name = "Ichi")
+        care = Care(medecine_name = "Vermifuge")
+        s.add(dog)
+        s.add(care)
+        for person in [persons[2], persons[1], persons[2], Person(id = 3)]:
+            s.add(CareSheet(animal = dog, care = care, given_by = person))
+            s.add(Location(location_type = LocationType.FOSTER_FAMILY,
+                           person = person))
+
+        s.person_plugin = BatchPlugin()
+        caresheets = s.get_all_caresheets()
+        self.assertEqual(calls, [[1, 2, 3]])
+        self.assertEqual([c.given_by.id if c.given_by else None
+                          for c in caresheets], [2, 1, 2, None])
+        self.assertIs(caresheets[0].given_by, caresheets[2].given_by)
+
+        calls.clear()
+        locations = s.get_all_locations()
+        self.assertEqual(calls, [[1, 2, 3]])
+        self.assertEqual(locations[1].person.name, "Person 1")
+
+        calls.clear()
+        self.assertEqual([p.id for p in s.get_persons_by_ids([2, 3, 1])], [2, 1])
+        self.assertEqual(calls, [[1, 2, 3]])
+
+        # Plugins without get_persons_by_ids() are asked for each person once
+        calls.clear()
+        s.person_plugin = PerIdPlugin()
+        locations = s.get_all_locations()
+        self.assertEqual(sorted(calls), [1, 2, 3])
+        self.assertEqual(locations[3].person, None)
+
+        s.person_plugin = None
+        s.close()
+
+    def test_config_cache(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        plugin = TestPlugin()
+
+        s.set_config("opt_test", "test_value")
+        s.set_plugin_config(plugin, "opt_test", "plugin_value")
+
+        queries = []
+        s.con.set_trace_callback(queries.append)
+
+        # Unchanged config : only the version is read, once per transaction
+        with s.transaction():
+            for i in range(3):
+                self.assertEqual(s.get_config("opt_test"), "test_value")
+                self.assertEqual(s.get_config("plugin_path"), "plugins")
+                self.assertIsNone(s.get_config("unknown"))
+                self.assertEqual(s.get_plugin_config(plugin, "opt_test"), "plugin_value")
+        self.assertEqual(queries, ["SELECT version FROM config_version"])
+
+        # And before each read outside of them
+        queries.clear()
+        self.assertEqual(s.get_config("opt_test"), "test_value")
+        s.check_config()
+        self.assertEqual(queries, ["SELECT version FROM config_version"] * 2)
+
+        def change_config():
+            con = sqlite3.connect("test.db")
+            con.execute("UPDATE config SET value = 'new_value' WHERE key = 'opt_test'")
+            con.execute("DELETE FROM plugin_config")
+            con.commit()
+            con.close()
+
+        # Changes made by other connections are seen by the next transaction
+        with s.transaction():
+            self.assertEqual(s.get_config("opt_test"), "test_value")
+            change_config()
+            self.assertEqual(s.get_config("opt_test"), "test_value")
+        self.assertEqual(s.get_config("opt_test"), "new_value")
+        self.assertIsNone(s.get_plugin_config(plugin, "opt_test"))
+
+        # Or by the next read, without any transaction
+        s.set_config("opt_test", "test_value")
+        s.set_plugin_config(plugin, "opt_test", "plugin_value")
+        change_config()
+        self.assertEqual(s.get_config("opt_test"), "new_value")
+        self.assertIsNone(s.get_plugin_config(plugin, "opt_test"))
+
+        # Rolled back writes are not kept
+        with self.assertRaises(ValueError):
+            with s.transaction():
+                s.set_config("opt_test", "rolled_back")
+                raise ValueError()
+        self.assertEqual(s.get_config("opt_test"), "new_value")
+
+        # Writing after another connection did doesn't hide its changes
+        other = SQLiteStorage()
+        other.connect("test.db", with_plugins = False)
+        other.set_config("opt_other", "other_value")
+        s.set_config("opt_test", "test_value")
+        self.assertEqual(s.get_config("opt_other"), "other_value")
+        other.close()
+
+        s.set_config("opt_test", "last_value")
+        queries.clear()
+        s.check_config()
+        self.assertEqual(len(queries), 1)
+
+        s.con.set_trace_callback(None)
+        s.close()
+
+    def test_reference_data(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        s.check_reference_data()
+
+        state = State(label = "Arrivé")
+        s.add(state)
+        s.add_many([Box(label = "Box 1"), Box(label = "Box 2")])
+
+        # Only the version is read, once per scope
+        queries = []
+        s.con.set_trace_callback(queries.append)
+        with s.identity_scope():
+            self.assertIs(s.get_state_by_id(state.id), state)
+            self.assertIs(s.get_state_by_id(str(state.id)), state)
+            self.assertIsNone(s.get_state_by_id(666))
+            self.assertEqual([box.label for box in s.get_all_boxes(limit = 1, after_id = 1)],
+                             ["Box 2"])
+        self.assertEqual(queries, ["SELECT version FROM reference_version"])
+
+        # And before each read outside of them
+        queries.clear()
+        self.assertIs(s.get_state_by_id(state.id), state)
+        self.assertEqual(len(s.get_all_boxes()), 2)
+        self.assertEqual(queries, ["SELECT version FROM reference_version"] * 2)
+        s.con.set_trace_callback(None)
+
+        # Writes through the storage are kept in memory
+        state.label = "Adopté"
+        s.update(state)
+        care = Care(medecine_name = "Vermifuge")
+        s.add(care)
+        s.delete(s.get_box_by_id(1))
+        s.check_reference_data()
+        self.assertIs(s.get_state_by_id(state.id), state)
+        self.assertIs(s.get_care_by_id(care.id), care)
+        self.assertEqual([box.id for box in s.get_all_boxes()], [2])
+
+        # Writes from other connections are seen by the next scope
+        def change_state(label):
+            con = sqlite3.connect("test.db")
+            con.execute("UPDATE state SET label = ?", [label])
+            con.commit()
+            con.close()
+
+        with s.transaction():
+            self.assertEqual(s.get_state_by_id(state.id).label, "Adopté")
+            change_state("Réservé")
+            self.assertEqual(s.get_state_by_id(state.id).label, "Adopté")
+        self.assertEqual(s.get_state_by_id(state.id).label, "Réservé")
+
+        # Or by the next read, without any scope
+        change_state("Parti")
+        self.assertEqual(s.get_state_by_id(state.id).label, "Parti")
+        change_state("Réservé")
+        self.assertEqual([state.label for state in s.get_all_states()], ["Réservé"])
+
+        # A failed write doesn't leave its changes in memory
+        state.label = "Not written"
+        with patch.object(s, "_SQLiteStorage__update", side_effect = sqlite3.OperationalError):
+            with self.assertRaises(sqlite3.OperationalError):
+                s.update(state)
+        self.assertEqual(s.get_state_by_id(state.id).label, "Réservé")
+
+        with self.assertRaises(ValueError):
+            with s.transaction():
+                s.add(State(label = "Rolled back"))
+                raise ValueError()
+        self.assertEqual(len(s.get_all_states()), 1)
+
+        # Writing after another connection did doesn't hide its changes
+        other = SQLiteStorage()
+        other.connect("test.db", with_plugins = False)
+        other.check_reference_data()
+        other.add(State(label = "From other"))
+        s.add(State(label = "From s"))
+        for storage in [s, other]:
+            storage.check_reference_data()
+            self.assertEqual([state.label for state in storage.get_all_states()],
+                             ["Réservé", "From other", "From s"])
+        other.close()
+
+        # Values are kept as stored, whatever their type when written
+        box = Box(label = "Box 3", surface_area = "12")
+        s.add(box)
+        self.assertIs(s.get_box_by_id(box.id), box)
+        self.assertEqual(box.surface_area, 12)
+        box.surface_area = "15"
+        s.update(box)
+        self.assertEqual(s.get_box_by_id(box.id).surface_area, 15)
+        self.assertEqual(s.get_box_occupancy()[-1].capacity(),
+                         Box(surface_area = 15).capacity(Species.DOG))
+
+        s.close()
+
+    def test_migrations(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        self.assertEqual(s.get_schema_version(), len(SQLiteStorage.migrations))
+
+        cursor = s.con.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN SELECT * FROM sheet WHERE animal_id = 1")
+        self.assertIn("sheet_animal_id", cursor.fetchone()['detail'])
+        s.close()
+
+        self.assertIn("sheet_animal_id", self.get_indexes())
+        self.assertIn("location_box_id", self.get_indexes())
+
+        # Bring the database back to the initial schema
+        con = sqlite3.connect("test.db")
+        for index in self.get_indexes():
+            con.execute("DROP INDEX " + index)
+        con.execute("PRAGMA user_version = 0")
+        con.commit()
+        con.close()
+        self.assertEqual(self.get_indexes(), [])
+
+        s = SQLiteStorage()
+        s.connect("test.db")
+        self.assertEqual(s.get_schema_version(), len(SQLiteStorage.migrations))
+        s.close()
+
+        self.assertIn("sheet_animal_id", self.get_indexes())
+
+    def get_pragma(self, s, pragma):
+        cursor = s.con.cursor()
+        cursor.execute("PRAGMA " + pragma)
+
+        return cursor.fetchone()[0]
+
+    def test_performance_profile(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        self.assertEqual(self.get_pragma(s, "journal_mode"), "delete")
+        s.close()
+
+        s = SQLiteStorage()
+        s.connect("test.db", profile = "wal")
+        self.assertEqual(self.get_pragma(s, "journal_mode"), "wal")
+        self.assertEqual(self.get_pragma(s, "busy_timeout"), 5000)
+        s.set_config("pragma_busy_timeout", "1000")
+        s.close()
+
+        # The profile and its overrides are stored in the database
+        s = SQLiteStorage()
+        s.connect("test.db")
+        self.assertEqual(self.get_pragma(s, "journal_mode"), "wal")
+        self.assertEqual(self.get_pragma(s, "synchronous"), 1)
+        self.assertEqual(self.get_pragma(s, "busy_timeout"), 1000)
+        s.close()
+
+    def test_invalid_performance_profile(self):
+        s = SQLiteStorage()
+        s.connect("test.db")
+        s.close()
+
+        with self.assertRaises(ValueError):
+            s.connect("test.db", profile = "turbo")
+
+        self.check_config({
+            "plugin_path" : "plugins"
+        })
+
     def test_add_empty_state(self):
         self.insertion_test(State(), "state")
 
@@ -1482,6 +2132,428 @@ class TestOssacaDBAPI(unittest.TestCase):
         self.check_get_all_items_by_id(self.cats, "get_cat_by_id", "compare_animal",
                                        ids = [cat.id for cat in self.cats])
 
+    def count_queries(self, s, func, *args):
+        queries = []
+        s.con.set_trace_callback(queries.append)
+        result = func(*args)
+        s.con.set_trace_callback(None)
+
+        return [result, len(queries)]
+
+    def test_get_all_animals_by_species_query_count(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+        s.check_reference_data()
+
+        # One query for the animals, then one per related table, whatever the
+        # number of animals. States, boxes, foods and bowls are in memory, their
+        # version being checked once.
+        for species in [Species.DOG, Species.CAT, Species.NAC]:
+            with self.subTest(species = species):
+                [animals, n_queries] = self.count_queries(s,
+                                        s.get_all_animals_by_species, species)
+                self.assertTrue(len(animals) > 0)
+                self.assertLessEqual(n_queries, 5)
+
+        s.close()
+
+    def test_identity_map(self):
+        s = SQLiteStorage(identity_map = True)
+        s.connect("example.db")
+
+        dogs = s.get_all_dogs()
+        self.assertIs(s.get_dog_by_id(dogs[0].id), dogs[0])
+        self.assertIs(s.get_animal_by_id(dogs[0].id), dogs[0])
+        self.assertIsNone(s.get_cat_by_id(dogs[0].id))
+
+        # The sheets of dogs[0] share the same location
+        self.assertIs(dogs[0].arrival_sheet.location, dogs[0].latest_sheet.location)
+        self.assertIs(dogs[0].latest_sheet.state,
+                      s.get_state_by_id(dogs[0].latest_sheet.state.id))
+
+        [dog, n_queries] = self.count_queries(s, s.get_dog_by_id, str(dogs[1].id))
+        self.assertIs(dog, dogs[1])
+        self.assertEqual(n_queries, 0)
+
+        s.close()
+
+    def test_identity_scope(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        location_id = s.get_all_locations()[0].id
+        self.assertIsNot(s.get_location_by_id(location_id),
+                         s.get_location_by_id(location_id))
+
+        with s.identity_scope():
+            location = s.get_location_by_id(location_id)
+            self.assertIs(s.get_location_by_id(location_id), location)
+            self.assertIs(s.get_all_locations()[0], location)
+
+        self.assertIsNot(s.get_location_by_id(location_id), location)
+
+        s.close()
+
+    def test_lazy_loading(self):
+        s = SQLiteStorage(lazy_loading = True)
+        s.connect("example.db")
+
+        # Only the animals are loaded up front
+        [dogs, n_queries] = self.count_queries(s, s.get_all_dogs)
+        self.assertEqual(n_queries, 1)
+
+        # The first access loads the sheets of all the dogs at once
+        [state, n_queries] = self.count_queries(s,
+                                    lambda: dogs[0].latest_sheet.state)
+        self.assertIsNotNone(state)
+        [label, n_queries_next] = self.count_queries(s,
+                                    lambda: dogs[1].latest_sheet.state.label)
+        self.assertEqual(n_queries_next, 0)
+
+        self.assertEqual(dogs[0].arrival_sheet.id, self.dogs[0].arrival_sheet.id)
+        self.assertIs(dogs[0].latest_sheet.animal, dogs[0])
+        self.assertTrue(isinstance(dogs[0].latest_sheet, Sheet))
+        self.assertTrue(dogs[0].latest_sheet != None)
+
+        for i in range(len(dogs)):
+            with self.subTest(i = i):
+                self.compare_animal(dogs[i], self.dogs[i])
+                self.compare_foodhabit(dogs[i].food_habits,
+                                       self.dogs[i].food_habits)
+
+        self.compare_animal(s.get_cat_by_id(self.cats[0].id), self.cats[0])
+
+        s.close()
+
+    def compare_summary(self, summary, animal):
+        self.assertEqual(summary.id, animal.id)
+        self.assertEqual(summary.name, animal.name)
+        self.assertEqual(summary.gender, animal.gender)
+        self.assertEqual(summary.birth_date, animal.birth_date)
+        self.assertEqual(summary.arrival_date, animal.arrival_date)
+        self.assertEqual(summary.age(), animal.age())
+        self.assertEqual(summary.picture,
+                         animal.pictures[0] if animal.pictures else None)
+
+        sheet = animal.latest_sheet
+        self.assertEqual(summary.state, sheet.state.label)
+        self.assertEqual(summary.location_type, sheet.location.location_type)
+        self.assertEqual(summary.box, sheet.location.box.label
+                                      if sheet.location.box is not None else None)
+
+    def test_get_summaries(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        [dogs, n_queries] = self.count_queries(s, s.get_dog_summaries)
+        self.assertEqual(n_queries, 1)
+        self.assertEqual(len(dogs), len(self.dogs))
+
+        for i in range(len(dogs)):
+            with self.subTest(i = i):
+                self.compare_summary(dogs[i], self.dogs[i])
+                self.assertEqual(dogs[i].ok_cats, self.dogs[i].ok_cats)
+
+        cats = list(s.iter_cat_summaries(chunk_size = 2))
+        self.assertEqual(len(cats), len(self.cats))
+
+        for i in range(len(cats)):
+            with self.subTest(i = i):
+                self.compare_summary(cats[i], self.cats[i])
+                self.assertEqual(cats[i].has_fiv, self.cats[i].has_fiv)
+                self.assertEqual(cats[i].has_felv, self.cats[i].has_felv)
+
+        s.close()
+
+    def test_get_box_occupancy(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+        s.check_reference_data()
+
+        # Plus the check of the boxes in memory
+        [occupancy, n_queries] = self.count_queries(s, s.get_box_occupancy)
+        self.assertEqual(n_queries, 2)
+
+        # The sheets are found by index, without any temporary one
+        queries = []
+        s.con.set_trace_callback(queries.append)
+        s.get_box_occupancy()
+        s.con.set_trace_callback(None)
+
+        plan = [row['detail'] for row in
+                s.con.execute("EXPLAIN QUERY PLAN " + queries[0])]
+        self.assertIn("sheet_location_id", " ".join(plan))
+        self.assertNotIn("AUTOMATIC", " ".join(plan))
+        self.assertEqual([o.box.id for o in occupancy],
+                         [box.id for box in s.get_all_boxes()])
+
+        for o in occupancy:
+            with self.subTest(box = o.box.label):
+                animals = s.get_all_animals_by_box_id(o.box.id)
+                self.assertEqual(o.count(), len(animals))
+
+                for species in [Species.DOG, Species.CAT, Species.NAC]:
+                    self.assertEqual(o.count(species),
+                        len([a for a in animals if a.species == species]))
+                    self.assertEqual(o.capacity(species),
+                                     o.box.capacity(species))
+
+        s.close()
+
+    def test_search_animals(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        animals = s.search_animals(self.dogs[0].name.lower())
+        self.assertEqual([a.id for a in animals], [self.dogs[0].id])
+
+        for animal in s.search_animals(self.cats[0].breed, Species.CAT):
+            self.assertEqual(animal.species, Species.CAT)
+
+        self.assertLessEqual(len(s.search_animals("a", limit = 2)), 2)
+        self.assertEqual(s.search_animals(""), [])
+        self.assertEqual(s.search_animals("\" ( * -"), [])
+
+        s.close()
+
+    def test_search_animals_identity_map(self):
+        s = SQLiteStorage(identity_map = True)
+        s.connect("example.db")
+
+        for animal in [self.dogs[0], self.cats[0]]:
+            with self.subTest(name = animal.name):
+                found = [a for a in s.search_animals(animal.name)
+                         if a.id == animal.id][0]
+                self.assertIs(type(found), type(animal))
+
+                # The search hit is the object later returned by id
+                self.assertIs(s.get_animal_by_id(animal.id), found)
+
+        self.assertIs(type(s.get_dog_by_id(self.dogs[0].id)), Dog)
+
+        s.close()
+
+    def test_get_animal_by_implant(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        for animal in self.dogs + self.cats + self.nacs:
+            if animal.implant == "":
+                continue
+
+            with self.subTest(implant = animal.implant):
+                found = s.get_animal_by_implant(" " + animal.implant + " ")
+                self.assertIs(type(found), type(animal))
+                self.compare_animal(found, animal)
+
+        self.assertIsNone(s.get_animal_by_implant("UNKNOWN"))
+        self.assertIsNone(s.get_animal_by_implant(""))
+
+        cursor = s.con.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN SELECT id FROM animal " +
+                       "WHERE implant = ? AND implant != ''", ["JJ55"])
+        self.assertIn("animal_implant", cursor.fetchone()['detail'])
+
+        s.close()
+
+    def test_get_all_animals_query_count(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+        s.check_reference_data()
+
+        [animals, n_queries] = self.count_queries(s, s.get_all_animals)
+        self.assertLessEqual(n_queries, 5)
+        self.assertEqual([type(animal) for animal in animals],
+                         [type(animal) for animal in self.dogs + self.cats + self.nacs])
+
+        s.close()
+
+    def test_get_by_date_range(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        animals = self.dogs + self.cats + self.nacs
+        start = date.fromisoformat("2018-01-01")
+        end = date.fromisoformat("2019-05-29")
+
+        arrived = s.get_all_animals_by_arrival_date(start, end)
+        self.assertEqual(sorted(animal.id for animal in arrived),
+                         sorted(animal.id for animal in animals
+                                if start <= animal.arrival_date <= end))
+        self.assertEqual([animal.arrival_date for animal in arrived],
+                         sorted(animal.arrival_date for animal in arrived))
+        self.assertEqual(len(s.get_all_animals_by_arrival_date()), len(animals))
+
+        caresheets = s.get_all_caresheets_by_date(end = end)
+        self.assertEqual(sorted(cs.id for cs in caresheets),
+                         sorted(cs.id for cs in self.caresheets if cs.date <= end))
+
+        today = date.today()
+        self.assertEqual(len(s.get_all_sheets_by_date(today, today)),
+                         len([sheet for sheet in self.sheets if sheet.date == today]))
+        self.assertEqual(s.get_all_sheets_by_date(end = start), [])
+
+        for query in ["SELECT * FROM sheet WHERE date >= ? AND date <= ?",
+                      "SELECT * FROM caresheet WHERE date >= ? AND date <= ?",
+                      "SELECT * FROM animal WHERE arrival_date >= ? AND arrival_date <= ?"]:
+            cursor = s.con.cursor()
+            cursor.execute("EXPLAIN QUERY PLAN " + query,
+                           [start.isoformat(), end.isoformat()])
+            self.assertIn("INDEX", cursor.fetchone()['detail'])
+
+        s.close()
+
+    def test_export(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        out = io.StringIO()
+        ossaca_export.export(s, "animals", out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+
+        animals = self.dogs + self.cats + self.nacs
+        self.assertEqual([int(row['id']) for row in rows],
+                         sorted(animal.id for animal in animals))
+        self.assertEqual(rows[0]['species'], Species.DOG.name)
+        self.assertEqual(rows[0]['implant'], self.dogs[0].implant)
+
+        lines = list(ossaca_export.iter_export(s, "sheets", "jsonl"))
+        self.assertEqual(len(lines), len(self.sheets))
+        sheet = json.loads(lines[0])
+        self.assertEqual(sheet['id'], self.sheets[0].id)
+        self.assertEqual(sheet['state'], self.sheets[0].state.label)
+
+        for register in ["caresheets", "locations"]:
+            with self.subTest(register = register):
+                lines = list(ossaca_export.iter_export(s, register, "csv"))
+                self.assertGreater(len(lines), 1)
+
+        with self.assertRaises(ValueError):
+            list(ossaca_export.iter_export(s, "persons"))
+
+        with self.assertRaises(ValueError):
+            ossaca_export.iter_export(s, "animals", "xml")
+
+        s.close()
+
+    def test_get_animals_by_ids(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+        s.check_reference_data()
+
+        known = [self.nacs[0], self.cats[1], self.dogs[2], self.dogs[0]]
+        ids = [animal.id for animal in known]
+
+        [animals, n_queries] = self.count_queries(s, s.get_animals_by_ids,
+                                                  ids + [666])
+        self.assertLessEqual(n_queries, 5)
+        self.assertEqual([animal.id for animal in animals], ids)
+
+        for i in range(len(known)):
+            with self.subTest(i = i):
+                self.assertIs(type(animals[i]), type(known[i]))
+                self.compare_animal(animals[i], known[i])
+
+        # A single animal is read with one query, whatever its species
+        for animal in [self.nacs[0], self.cats[0]]:
+            with self.subTest(species = animal.species):
+                queries = []
+                s.con.set_trace_callback(queries.append)
+                self.assertIs(type(s.get_animal_by_id(animal.id)), type(animal))
+                s.con.set_trace_callback(None)
+                self.assertEqual(len([q for q in queries if "JOIN dog" in q
+                                      or "FROM dog" in q or "FROM cat" in q]), 1)
+
+        s.close()
+
+    def test_get_all_pages(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        dogs = s.get_all_dogs(limit = 2, after_id = self.dogs[0].id)
+        self.assertEqual([dog.id for dog in dogs],
+                         [dog.id for dog in self.dogs[1:3]])
+
+        sheets = s.get_all_sheets_by_animal_id(self.dogs[0].id, limit = 1,
+                                               after_id = self.sheets[0].id)
+        self.assertEqual([sheet.id for sheet in sheets], [self.sheets[1].id])
+
+        self.assertEqual(s.get_all_states(after_id = len(self.states)), [])
+
+        animals = s.get_all_animals(limit = 5, after_id = 2)
+        self.assertEqual([animal.id for animal in animals], [3, 4, 5, 6, 7])
+
+        s.close()
+
+    def test_iter_all(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+
+        for chunk_size in [1, 2, 3, 100]:
+            with self.subTest(chunk_size = chunk_size):
+                self.check_animal_list(self.dogs, list(s.iter_all_dogs(chunk_size)))
+                self.check_animal_list(self.dogs + self.cats + self.nacs,
+                                       list(s.iter_all_animals(chunk_size)))
+
+                sheets = list(s.iter_all_sheets(chunk_size))
+                self.assertEqual(len(sheets), len(self.sheets))
+                for sheet, known_sheet in zip(sheets, self.sheets):
+                    self.compare_sheet(sheet, known_sheet)
+
+                caresheets = list(s.iter_all_caresheets_by_animal_id(
+                                    self.dogs[3].id, chunk_size))
+                self.assertEqual([cs.id for cs in caresheets],
+                                 [cs.id for cs in self.caresheets
+                                  if cs.animal is self.dogs[3]])
+
+        s.close()
+
+    def test_iter_all_identity_map(self):
+        s = SQLiteStorage(identity_map = True)
+        s.connect("example.db")
+
+        dog = s.get_dog_by_id(self.dogs[1].id)
+        n_objects = len(s._SQLiteStorage__objects)
+
+        # The pages don't stay in the identity map, but the objects it already
+        # held are reused
+        for iter_all in [s.iter_all_dogs, s.iter_all_animals, s.iter_all_sheets]:
+            with self.subTest(iter_all = iter_all.__name__):
+                sizes = []
+                found = []
+                for obj in iter_all(1):
+                    sizes.append(len(s._SQLiteStorage__objects))
+                    found.append(obj)
+
+                self.assertEqual(set(sizes), {n_objects})
+                self.assertTrue(len(found) > 1)
+
+        self.assertIn(dog, list(s.iter_all_dogs(2)))
+        self.assertIs([d for d in s.iter_all_dogs(2) if d.id == dog.id][0], dog)
+
+        s.close()
+
+    def test_get_all_sheets_query_count(self):
+        s = SQLiteStorage()
+        s.connect("example.db")
+        s.check_reference_data()
+
+        # One query for the sheets, then a fixed number for their animals,
+        # locations and states, whatever the number of sheets
+        for get_all in [s.get_all_sheets, s.get_all_sheets_by_date]:
+            with self.subTest(get_all = get_all.__name__):
+                [sheets, n_queries] = self.count_queries(s, get_all)
+                self.assertEqual(len(sheets), len(self.sheets))
+                self.assertLessEqual(n_queries, 6)
+
+        # A sheet is the one linked to its animal
+        sheets = s.get_all_sheets()
+        for sheet in sheets:
+            if sheet.animal is not None and sheet.animal.latest_sheet.id == sheet.id:
+                self.assertIs(sheet.animal.latest_sheet, sheet)
+
+        s.close()
+
     def test_get_all_cares(self):
         self.check_get_all_items(self.cares, "get_all_cares", "compare_care")
 
@@ -1820,5 +2892,359 @@ class TestOssacaPlugin(unittest.TestCase):
     def test_get_plugin_config_multiple(self):
         pass
 
+class TestGarradinPlugin(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test_plugin.sqlite")
+        self.garradin_path = os.path.join(self.tmp_dir.name, "test_garradin.sqlite")
+
+        con = sqlite3.connect(self.garradin_path)
+        con.executescript('''
+            CREATE TABLE membres_categories (id INTEGER PRIMARY KEY, nom TEXT);
+            CREATE TABLE membres (id INTEGER PRIMARY KEY, id_categorie INTEGER,
+                nom TEXT, email TEXT, adresse TEXT, code_postal TEXT,
+                ville TEXT, pays TEXT, telephone TEXT);
+            INSERT INTO membres_categories VALUES (1, 'Vétérinaire'), (2, 'fa');
+            INSERT INTO membres VALUES
+                (1, 1, 'Dr Kim', '', '', '', '', '', ''),
+                (2, 2, 'Lee', '', '', '', '', '', '');
+        ''')
+        con.commit()
+        con.close()
+
+        if "plugins" not in sys.path:
+            sys.path.append("plugins")
+        from plugin_garradin import GarradinPlugin
+
+        self.s = SQLiteStorage()
+        self.s.connect(self.db_path, with_plugins = False)
+        self.p = GarradinPlugin()
+        self.p._attach(self.s)
+        self.p.set_config("database_path", self.garradin_path)
+        self.assertTrue(self.p.load())
+
+    def tearDown(self):
+        self.p.destroy()
+        self.s.close()
+        self.tmp_dir.cleanup()
+
+    def test_get_persons(self):
+        vet = self.p.get_person_by_id(1)
+        self.assertEqual(vet.name, "Dr Kim")
+        self.assertEqual(vet.type, PersonType.VET)
+        self.assertIsNone(self.p.get_person_by_id(3))
+
+        persons = self.p.get_all_persons()
+        self.assertEqual([p.name for p in persons], ["Dr Kim", "Lee"])
+        self.assertEqual(persons[1].type, PersonType.FOSTER_FAMILY)
+
+    def test_get_persons_by_ids(self):
+        persons = self.p.get_persons_by_ids([2, 3, 1, 2])
+        self.assertEqual(sorted(p.name for p in persons), ["Dr Kim", "Lee"])
+
+        queries = []
+        self.p.con.set_trace_callback(queries.append)
+        self.assertIs(self.p.get_person_by_id(2),
+                      [p for p in persons if p.id == 2][0])
+        self.assertIsNone(self.p.get_person_by_id(3))
+        self.assertEqual(len(self.p.get_persons_by_ids([1, 3])), 1)
+        self.p.con.set_trace_callback(None)
+        self.assertEqual(queries, ["PRAGMA data_version"] * 3)
+
+    def test_attach(self):
+        self.s.person_plugin = self.p
+        self.assertFalse(self.s.attach_persons())
+
+        self.p.attach_database = True
+        self.assertTrue(self.s.attach_persons())
+
+        dog = Dog(name = "Ichi")
+        care = Care(medecine_name = "Vermifuge")
+        self.s.add(dog)
+        self.s.add(Cat(name = "Su Yeon"))
+        self.s.add(care)
+        location = Location(location_type = LocationType.FOSTER_FAMILY,
+                            person = Person(id = 2))
+        self.s.add(location)
+        self.s.add(Sheet(date = date.today(), animal = dog, location = location))
+        self.s.add(CareSheet(animal = dog, care = care, given_by = Person(id = 1)))
+        self.s.add(CareSheet(animal = dog, care = care, given_by = Person(id = 2)))
+
+        cursor = self.s.con.execute("SELECT * FROM person ORDER BY id")
+        self.assertEqual([tuple(row) for row in cursor],
+                         [(1, "Dr Kim", PersonType.VET),
+                          (2, "Lee", PersonType.FOSTER_FAMILY)])
+
+        with self.assertRaises(sqlite3.OperationalError):
+            self.s.con.execute("DELETE FROM garradin.membres")
+
+        # The view doesn't touch the plugin, queried outside of its lock
+        con = sqlite3.connect(self.garradin_path)
+        con.execute("INSERT INTO membres_categories VALUES (3, 'Adoptant')")
+        con.execute("INSERT INTO membres VALUES (3, 3, 'Choi', '', '', '', '', '', '')")
+        con.execute("INSERT INTO membres VALUES (4, NULL, 'Han', '', '', '', '', '', '')")
+        con.commit()
+        con.close()
+
+        categories = dict(self.p._GarradinPlugin__categories)
+        with patch.object(self.p, "_GarradinPlugin__categories", None):
+            cursor = self.s.con.execute("SELECT * FROM person ORDER BY id")
+            self.assertEqual([row['type'] for row in cursor],
+                             [PersonType.VET, PersonType.FOSTER_FAMILY,
+                              PersonType.ADOPTER, PersonType.OTHER])
+        self.assertEqual(self.p._GarradinPlugin__categories, categories)
+
+        # Databases that can't be attached fall back on the Python joins
+        s = SQLiteStorage()
+        s.connect(self.db_path, with_plugins = False)
+        s.person_plugin = self.p
+
+        # Missing, then not a garradin database
+        missing_path = os.path.join(self.tmp_dir.name, "missing.sqlite")
+        for path in [missing_path, self.db_path]:
+            with self.subTest(path = path):
+                self.p.path = path
+                self.assertFalse(s.attach_persons())
+                self.assertEqual([row['name'] for row in
+                                  s.con.execute("PRAGMA database_list")], ["main"])
+
+        self.p.path = self.garradin_path
+
+        # The read-only URI is not taken for a file name
+        self.assertFalse(os.path.exists(missing_path))
+        for directory in [".", self.tmp_dir.name]:
+            self.assertEqual([f for f in os.listdir(directory)
+                              if f.startswith("file:")], [])
+        s.person_plugin = None
+        s.close()
+
+        # Joined in SQL, or in Python without the person view
+        for attached in [True, False]:
+            with self.subTest(attached = attached):
+                self.s.persons_attached = attached
+
+                animals = self.s.get_all_animals_by_host_type(PersonType.FOSTER_FAMILY)
+                self.assertEqual([a.name for a in animals], ["Ichi"])
+                self.assertEqual(self.s.get_all_animals_by_host_type(PersonType.VET), [])
+
+                caresheets = self.s.get_all_caresheets_by_person_type(PersonType.VET)
+                self.assertEqual([c.given_by.name for c in caresheets], ["Dr Kim"])
+
+        self.s.person_plugin = None
+
+    def test_cache(self):
+        vet = self.p.get_person_by_id(1)
+        persons = self.p.get_all_persons()
+
+        # Only data_version is read while the database is unchanged
+        queries = []
+        self.p.con.set_trace_callback(queries.append)
+        self.assertIs(self.p.get_person_by_id(1), vet)
+        self.assertIs(self.p.get_person_by_id(2), persons[1])
+        self.assertIsNone(self.p.get_person_by_id(3))
+        self.assertEqual(self.p.get_all_persons(), persons)
+        self.p.con.set_trace_callback(None)
+        self.assertEqual(queries, ["PRAGMA data_version"] * 4)
+
+        con = sqlite3.connect(self.garradin_path)
+        con.execute("UPDATE membres SET nom = 'Dr Park' WHERE id = 1")
+        con.execute("INSERT INTO membres VALUES (3, 1, 'Choi', '', '', '', '', '', '')")
+        con.commit()
+        con.close()
+
+        self.assertEqual(self.p.get_person_by_id(1).name, "Dr Park")
+        self.assertEqual(self.p.get_person_by_id(3).name, "Choi")
+        self.assertEqual(len(self.p.get_all_persons()), 3)
+
+    def test_cache_same_file_stats(self):
+        self.assertEqual(self.p.get_person_by_id(1).name, "Dr Kim")
+        stat = os.stat(self.garradin_path)
+
+        # A write keeping the size of the file, within the resolution of its
+        # modification time
+        con = sqlite3.connect(self.garradin_path)
+        con.execute("UPDATE membres SET nom = 'Dr Lim' WHERE id = 1")
+        con.commit()
+        con.close()
+        os.utime(self.garradin_path, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(os.stat(self.garradin_path).st_size, stat.st_size)
+
+        self.assertEqual(self.p.get_person_by_id(1).name, "Dr Lim")
+
+class TestSQLiteStorageManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "test_manager.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_acquire_release(self):
+        m = SQLiteStorageManager(self.db_path, pool_size = 1)
+
+        s1 = m.acquire()
+        self.assertIsNotNone(s1.con)
+        s1.add(State(label = "Arrivé"))
+        m.release(s1)
+
+        # The idle storage is leased again, with its connection still open
+        s2 = m.acquire()
+        self.assertIs(s2, s1)
+        self.assertEqual(len(s2.get_all_states()), 1)
+
+        # The pool is empty, so a new storage is created
+        s3 = m.acquire()
+        self.assertIsNot(s3, s2)
+
+        m.release(s2)
+        m.release(s3)
+
+        m.close()
+
+    def test_release_with_exception(self):
+        m = SQLiteStorageManager(self.db_path)
+
+        s = m.acquire()
+        s.con.execute("INSERT INTO state (label, description) VALUES ('a', 'b')")
+        m.release(s, Exception())
+
+        s = m.acquire()
+        self.assertEqual(s.get_all_states(), [])
+        m.release(s)
+
+        m.close()
+
+    def test_shared_plugins(self):
+        m = SQLiteStorageManager(self.db_path)
+        registry = m.get_plugin_registry()
+
+        s1 = m.acquire()
+        s2 = m.acquire()
+        path_length = len(sys.path)
+
+        self.assertIs(s1.plugins, registry.plugins)
+        self.assertIs(s2.plugins, registry.plugins)
+        self.assertIs(s1.person_plugin, registry.person_plugin)
+
+        s3 = m.acquire()
+        self.assertEqual(len(sys.path), path_length)
+
+        for s in [s1, s2, s3]:
+            m.release(s)
+
+        m.close()
+
+    def test_threads(self):
+        m = SQLiteStorageManager(self.db_path, pool_size = 2,
+                                 max_storages = 2)
+        lock = threading.Lock()
+        leased = [0, 0]
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(5):
+                    s = m.acquire()
+
+                    with lock:
+                        leased[0] += 1
+                        leased[1] = max(leased)
+
+                    s.add(State(label = "State %d-%d" % (n, i)))
+                    s.get_all_states()
+
+                    with lock:
+                        leased[0] -= 1
+
+                    m.release(s)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target = work, args = (n,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(leased[1], 2)
+
+        # The storages leased by the other threads, reused by this one, see
+        # all the states, whichever thread added them
+        storages = [m.acquire(), m.acquire()]
+        for s in storages:
+            labels = [row['label'] for row in
+                      s.con.execute("SELECT label FROM state ORDER BY id")]
+            self.assertEqual(len(labels), 30)
+            self.assertEqual([state.label for state in s.get_all_states()], labels)
+        for s in storages:
+            m.release(s)
+
+        m.close()
+
+    def test_acquire_timeout(self):
+        m = SQLiteStorageManager(self.db_path, max_storages = 1)
+
+        s = m.acquire()
+        with self.assertRaises(TimeoutError):
+            m.acquire(timeout = 0.01)
+
+        m.release(s)
+        m.release(m.acquire(timeout = 0.01))
+
+        m.close()
+
+########################### Model ##############################################
+
+class TestOssacaModel(unittest.TestCase):
+
+    def test_slots(self):
+        for obj in [State(), Dog(), Cat(), CareSheet(), Sheet(), Location(),
+                    Box(), FoodHabit(), Person()]:
+            with self.subTest(cls = type(obj).__name__):
+                self.assertFalse(hasattr(obj, "__dict__"))
+
+        with self.assertRaises(AttributeError):
+            Sheet().unknown = 1
+
+    def test_pickle(self):
+        dog = Dog(id = 3, name = "Ichi", ok_cats = CatCompatibility.YES)
+        dog.latest_sheet = Sheet(id = 4, animal = dog, state = State(1, "Arrivé"))
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            with self.subTest(protocol = protocol):
+                copy = pickle.loads(pickle.dumps(dog, protocol))
+
+                self.assertEqual(copy.id, 3)
+                self.assertEqual(copy.name, "Ichi")
+                self.assertEqual(copy.ok_cats, CatCompatibility.YES)
+                self.assertEqual(copy.birth_date, dog.birth_date)
+                self.assertEqual(copy.latest_sheet.state.label, "Arrivé")
+                self.assertIs(copy.latest_sheet.animal, copy)
+
+        for obj in [State(1, "Arrivé"), Cat(has_fiv = 1), Care(dose = "1"),
+                    CareSheet(disease = Disease(2)), FoodHabit(food = Food(3)),
+                    Location(box = Box(4)), Box(surface_area = 12),
+                    Person(address = Address(city = "Lyon"))]:
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                with self.subTest(cls = type(obj).__name__, protocol = protocol):
+                    copy = pickle.loads(pickle.dumps(obj, protocol))
+                    self.assertIs(type(copy), type(obj))
+                    self.assertEqual(pickle.dumps(copy, protocol),
+                                     pickle.dumps(obj, protocol))
+
+    def test_copy(self):
+        sheet = Sheet(id = 4, state = State(1, "Arrivé"))
+
+        clone = copy.copy(sheet)
+        self.assertEqual(clone.id, 4)
+        self.assertIs(clone.state, sheet.state)
+
+        clone = copy.deepcopy(sheet)
+        self.assertEqual(clone.state.label, "Arrivé")
+        self.assertIsNot(clone.state, sheet.state)
+
 if __name__ == '__main__':
     unittest.main()
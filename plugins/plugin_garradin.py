@@ -5,10 +5,20 @@ from ossaca_model import *
 from ossaca_database import *
 from ossaca_plugin import *
 import unicodedata
+from urllib.request import pathname2url
 
 class GarradinPlugin(OssacaPersonProviderPlugin):
     '''
     Plugin to retrieve Person infos in a garradin database
+
+    The persons read are kept in memory, and shared by all the callers, until
+    the garradin database changes. A change is detected with PRAGMA
+    data_version, which only reads the database header, and from the
+    modification time and size of the database and of its WAL file.
+
+    If the attach_database config is "1", the garradin database is also
+    attached read-only to the connections of the storages, with a temporary
+    person view (id, name, type) that their queries can join.
     '''
 
     default_config = {
@@ -17,13 +27,43 @@ class GarradinPlugin(OssacaPersonProviderPlugin):
             "category_foster_family" : "FA",
             "category_volunteer" : "Bénévole",
             "category_adopter" : "Adoptant",
-            "category_vet" : "Vétérinaire"
+            "category_vet" : "Vétérinaire",
+            "attach_database" : "0"
     }
 
+    # Name of the garradin database on the connections it is attached to
+    schema = "garradin"
+
+    person_view = '''
+        CREATE TEMP VIEW IF NOT EXISTS person AS
+        SELECT membres.id, membres.nom AS name,
+               garradin_person_type(membres_categories.nom) AS type
+        FROM garradin.membres
+        LEFT JOIN garradin.membres_categories
+            ON membres.id_categorie = membres_categories.id
+        '''
+
     def __init__(self):
         OssacaPersonProviderPlugin.__init__(self, "garradin_plugin")
         self.cat_lookup = {}
         self.con = None
+        self.path = None
+        self.attach_database = False
+
+        # Person type of each category name already seen
+        self.__categories = {}
+
+        # Persons read since the last change of the database, by id. A None
+        # value means there is no such person.
+        self.__persons = {}
+
+        # All the persons, if get_all_persons() was called since the last
+        # change of the database
+        self.__all_persons = None
+
+        # Stats of the database files and data_version the cache was filled at
+        self.__file_version = None
+        self.__data_version = None
 
     def __set_default_config(self):
         for key, val in GarradinPlugin.default_config.items():
@@ -55,26 +95,116 @@ class GarradinPlugin(OssacaPersonProviderPlugin):
         if not os.path.isfile(path):
             return False
 
-        self.con = sqlite3.connect(path)
+        # Storages call the plugin from their own thread, one at a time
+        self.path = path
+        self.con = sqlite3.connect(path, check_same_thread = False)
         self.con.row_factory = sqlite3.Row
 
+        self.__file_version = self.__get_file_version()
+        self.__data_version = self.__get_data_version()
+
         return True
 
+    def __get_file_version(self):
+        version = []
+
+        for file_path in [self.path, self.path + "-wal"]:
+            try:
+                stat = os.stat(file_path)
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                version.append(None)
+
+        return version
+
+    def __get_data_version(self):
+        return self.con.execute("PRAGMA data_version").fetchone()[0]
+
+    def clear_cache(self):
+        self.__persons = {}
+        self.__all_persons = None
+
+    def __check_cache(self):
+        '''
+        Clears the cache if the garradin database changed since it was filled
+        '''
+        # A write may keep the size of the files, and happen within the
+        # resolution of their modification time : data_version is always
+        # checked, the stats of the files being only an extra hint
+        file_version = self.__get_file_version()
+        data_version = self.__get_data_version()
+
+        if file_version != self.__file_version or \
+           data_version != self.__data_version:
+            self.__file_version = file_version
+            self.__data_version = data_version
+            self.clear_cache()
+
     def load(self):
         self.__set_default_config()
         self.__load_category_lookup_table()
+        self.attach_database = self.get_config("attach_database") == "1"
         return self.__connect()
 
+    def attach(self, con):
+        '''
+        Attaches the garradin database read-only to con, and creates the
+        temporary person view on it. Returns False if the database can't be
+        attached, the storage then joining the persons in Python. con must
+        have been opened with uri = True.
+        '''
+        if not self.attach_database or self.con is None:
+            return False
+
+        uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(self.path))
+
+        try:
+            con.execute("ATTACH DATABASE ? AS " + GarradinPlugin.schema, [uri])
+        except sqlite3.Error:
+            return False
+
+        try:
+            cursor = con.execute('''
+                SELECT COUNT(*) FROM garradin.sqlite_master
+                WHERE type = 'table' AND name IN ('membres', 'membres_categories')
+                ''')
+            if cursor.fetchone()[0] != 2:
+                raise sqlite3.DatabaseError("Not a garradin database")
+        except sqlite3.Error:
+            con.execute("DETACH DATABASE " + GarradinPlugin.schema)
+            return False
+
+        # The function is called by the queries of the storages, outside of
+        # their plugin lock : it only reads the map built here, the
+        # categories created since being matched without being kept
+        categories = {row[0] : self.__get_person_type_from_category(row[0])
+                      for row in con.execute(
+                          "SELECT nom FROM garradin.membres_categories")}
+
+        con.create_function("garradin_person_type", 1,
+            lambda category: int(categories[category] if category in categories
+                                 else self.__match_category(category)),
+            deterministic = True)
+        con.execute(GarradinPlugin.person_view)
+
+        return True
+
     def destroy(self):
         if self.con is not None:
             self.con.close()
 
-    def __get_person_type_from_category(self, category):
-        cat_norm = self.__normalize_str(category)
+    def __match_category(self, category):
+        cat_norm = self.__normalize_str(category or "")
         if cat_norm in self.cat_lookup:
             return self.cat_lookup[cat_norm]
-        else:
-            return PersonType.OTHER
+
+        return PersonType.OTHER
+
+    def __get_person_type_from_category(self, category):
+        if category not in self.__categories:
+            self.__categories[category] = self.__match_category(category)
+
+        return self.__categories[category]
 
     def __person_from_row(self, row):
         return Person(
@@ -92,6 +222,14 @@ class GarradinPlugin(OssacaPersonProviderPlugin):
         )
 
     def get_person_by_id(self, id):
+        self.__check_cache()
+
+        if id in self.__persons:
+            return self.__persons[id]
+
+        if self.__all_persons is not None:
+            return None
+
         query = '''
         SELECT membres.id, membres.nom, membres.email, membres.adresse,
                membres.code_postal, membres.ville, membres.pays, membres.telephone,
@@ -105,12 +243,55 @@ class GarradinPlugin(OssacaPersonProviderPlugin):
         cursor.execute(query, [id])
         row = cursor.fetchone()
 
-        if row is None:
-            return None
+        person = None
+        if row is not None:
+            person = self.__person_from_row(row)
+
+        self.__persons[id] = person
+        return person
 
-        return self.__person_from_row(row)
+    def get_persons_by_ids(self, ids):
+        self.__check_cache()
+
+        persons = []
+        missing = []
+        for id in set(ids):
+            if id in self.__persons:
+                if self.__persons[id] is not None:
+                    persons.append(self.__persons[id])
+            elif self.__all_persons is None:
+                missing.append(id)
+
+        query = '''
+        SELECT membres.id, membres.nom, membres.email, membres.adresse,
+               membres.code_postal, membres.ville, membres.pays, membres.telephone,
+               membres_categories.nom as category
+        FROM membres
+        LEFT JOIN membres_categories ON membres.id_categorie = membres_categories.id
+        WHERE membres.id IN (%s)
+        '''
+
+        for i in range(0, len(missing), SQLiteStorage.max_ids_per_query):
+            chunk = missing[i:i + SQLiteStorage.max_ids_per_query]
+            cursor = self.con.cursor()
+            cursor.execute(query % ", ".join(["?"] * len(chunk)), chunk)
+
+            for row in cursor:
+                person = self.__person_from_row(row)
+                self.__persons[person.id] = person
+                persons.append(person)
+
+            for id in chunk:
+                self.__persons.setdefault(id, None)
+
+        return persons
 
     def get_all_persons(self):
+        self.__check_cache()
+
+        if self.__all_persons is not None:
+            return list(self.__all_persons)
+
         persons = []
         query = '''
         SELECT membres.id, membres.nom, membres.email, membres.adresse,
@@ -122,6 +303,13 @@ class GarradinPlugin(OssacaPersonProviderPlugin):
 
         cursor = self.con.cursor()
         for row in cursor.execute(query) :
-            persons.append(self.__person_from_row(row))
+            # Keep the persons already read
+            person = self.__persons.get(row['id'])
+            if person is None:
+                person = self.__person_from_row(row)
+            persons.append(person)
 
-        return persons
+        self.__persons = {person.id : person for person in persons}
+        self.__all_persons = persons
+
+        return list(persons)